@@ -0,0 +1,231 @@
+# Benchmarks for the reChat parser in specialtopics.py
+#
+# Run with:  python bench_rechat.py [--messages N] [--seed S] [parser|mentions]
+#
+# The parser suite replays large synthetic transcripts (built with the generators
+# from test_STA_fsa.py) and reports, for each entry point:
+#   msgs/s     messages parsed per second over the whole transcript
+#   p50, p99   per-message latency in microseconds
+#   alloc B    average tracemalloc high-water mark per message, in bytes, i.e. how
+#              much memory one message needs while it is being parsed
+
+import argparse
+import sys
+import time
+import timeit
+import tracemalloc
+from random import choice, choices, randint, random, seed
+
+import specialtopics as ST
+from test_STA_fsa import randomChannel, randomPart, randomUsername
+
+randomSeed = 0
+transcriptLength = 200_000     # messages in the parser benchmark transcript
+connectionLength = 50          # average messages per connection in the transcript
+allocationSample = 5000        # messages measured individually for the alloc column
+
+messageSizes = [ 100, 1024, 8 * 1024, 64 * 1024 ]
+plainWords = [ "hello", "the", "quick", "brown", "fox", "@nobody", "someone@example.com", "#channel" ]
+mentionRate = 0.05      # fraction of words in a message that are valid usernames
+
+
+def splitMentions(message):
+    '''The old extract_mentions: split into words and validate each @ word.  Kept as the baseline.'''
+    words = message.split()
+    return {word for word in words if word.startswith('@') and ST.is_valid_username(word)}
+
+
+def randomMessage(size):
+    '''A message of about size bytes of plain words with some valid mentions mixed in.'''
+    words = []
+    length = 0
+    while length < size:
+        word = randomUsername() if random() < mentionRate else choice(plainWords)
+        words.append(word)
+        length += len(word) + 1
+    return " ".join(words)[:size]
+
+
+def timePerCall(f, message, number=200, repeat=5):
+    '''Best time in seconds for one call of f(message).'''
+    return min(timeit.repeat(lambda: f(message), number=number, repeat=repeat)) / number
+
+
+def benchMentions():
+    '''Compare extract_mentions against the split based baseline over a range of message sizes.'''
+    seed(randomSeed)
+    print(f"{'size':>8} {'split (us)':>12} {'scan (us)':>12} {'speedup':>8}")
+    for size in messageSizes:
+        message = randomMessage(size)
+        if splitMentions(message) != ST.extract_mentions(message):
+            sys.exit(f"extract_mentions disagrees with the baseline on a {size} byte message")
+        number = max(10, 200_000 // size)
+        old = timePerCall(splitMentions, message, number)
+        new = timePerCall(ST.extract_mentions, message, number)
+        print(f"{size:>8} {old * 1e6:>12.1f} {new * 1e6:>12.1f} {old / new:>7.2f}x")
+
+
+#############################################
+# Parser throughput
+
+# What a connected user does next in each mode, with relative weights
+commandModeMoves = { "list": 3, "join": 5, "dm": 3, "error": 2, "post": 1 }
+talkingModeMoves = { "post": 60, "mentionPost": 15, "read": 10, "leave": 6, "error": 9 }
+
+
+def randomText():
+    return " ".join(choice(plainWords) for _ in range(randint(1, 30)))
+
+
+def randomError(mode):
+    '''A message that is invalid in mode, so the parser stays in that mode.'''
+    unknown = "\\" + randomPart() + "x"     # no command ends in x
+    if mode == "command":
+        return choice([
+            unknown,
+            "\\join " + randomPart(),         # channels start with #
+            "\\dm " + randomPart(),           # and usernames with @
+            "\\list " + randomPart() + "x",
+            "\\read",
+            "\\LEAVE now",
+        ])
+    return choice([
+        unknown,
+        "\\join " + randomChannel(),
+        "\\dm " + randomUsername(),
+        "\\list channels",
+        "\\quit",
+    ])
+
+
+def randomConnection():
+    '''The messages from one connection: a greeting, a random walk through the modes, and a quit.'''
+    messages = [""]
+    mode = "command"
+    for _ in range(randint(1, 2 * connectionLength)):
+        moves = commandModeMoves if mode == "command" else talkingModeMoves
+        move = choices(list(moves), weights=list(moves.values()))[0]
+        if move == "list":
+            messages.append("\\list " + choice(["channels", "users"]))
+        elif move == "join":
+            messages.append("\\join " + randomChannel())
+            mode = "channel"
+        elif move == "dm":
+            messages.append("\\dm " + randomUsername())
+            mode = "dm"
+        elif move == "read":
+            messages.append("\\read")
+        elif move == "leave":
+            messages.append("\\leave")
+            mode = "command"
+        elif move == "post":
+            messages.append(randomText())
+        elif move == "mentionPost":
+            messages.append(" ".join([randomText()] + [randomUsername() for _ in range(randint(1, 6))]))
+        else:
+            messages.append(randomError(mode))
+    if mode != "command":
+        messages.append("\\leave")         # \quit only works in command mode
+    messages.append("\\quit")
+    return messages
+
+
+def randomTranscript(length):
+    '''A list of connections, each a list of messages, with about length messages in total.'''
+    connections = []
+    total = 0
+    while total < length:
+        connection = randomConnection()
+        connections.append(connection)
+        total += len(connection)
+    return connections
+
+
+def parseCommandRunner():
+    '''Parser for one connection using reChatParseCommand and a state dict, as the tests do.'''
+    state = None
+    def run(message):
+        nonlocal state
+        _, state = ST.reChatParseCommand(message, state)
+    return run
+
+
+def sessionRunner():
+    '''Parser for one connection using a ChatSession.'''
+    return ST.ChatSession().parse
+
+
+entryPoints = {
+    "reChatParseCommand": parseCommandRunner,
+    "ChatSession.parse": sessionRunner,
+}
+
+
+def percentile(sortedValues, fraction):
+    return sortedValues[min(len(sortedValues) - 1, int(fraction * len(sortedValues)))]
+
+
+def timeEntryPoint(makeRunner, connections):
+    '''Returns messages/sec and the sorted per-message latencies in nanoseconds.'''
+    clock = time.perf_counter_ns
+    latencies = []
+    record = latencies.append
+    start = clock()
+    for connection in connections:
+        run = makeRunner()
+        for message in connection:
+            before = clock()
+            run(message)
+            record(clock() - before)
+    elapsed = clock() - start
+    latencies.sort()
+    return len(latencies) / (elapsed / 1e9), latencies
+
+
+def allocationPerMessage(makeRunner, connections):
+    '''Average tracemalloc high-water mark, in bytes, while parsing one message.'''
+    tracemalloc.start()
+    total = 0
+    count = 0
+    for connection in connections:
+        run = makeRunner()
+        for message in connection:
+            tracemalloc.reset_peak()
+            before, _ = tracemalloc.get_traced_memory()
+            run(message)
+            total += tracemalloc.get_traced_memory()[1] - before
+            count += 1
+        if count >= allocationSample:
+            break
+    tracemalloc.stop()
+    return total / count
+
+
+def benchParser(length):
+    seed(randomSeed)
+    connections = randomTranscript(length)
+    messages = sum(len(connection) for connection in connections)
+    print(f"{messages} messages over {len(connections)} connections")
+    print(f"{'entry point':<20} {'msgs/s':>10} {'p50 (us)':>9} {'p99 (us)':>9} {'alloc B':>8}")
+    for name, makeRunner in entryPoints.items():
+        rate, latencies = timeEntryPoint(makeRunner, connections)
+        allocated = allocationPerMessage(makeRunner, connections)
+        p50 = percentile(latencies, 0.50) / 1000
+        p99 = percentile(latencies, 0.99) / 1000
+        print(f"{name:<20} {rate:>10.0f} {p50:>9.2f} {p99:>9.2f} {allocated:>8.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="reChat parser benchmarks")
+    parser.add_argument("suites", nargs="*", help="parser and/or mentions (default: both)")
+    parser.add_argument("--messages", type=int, default=transcriptLength, help="messages in the parser transcript")
+    parser.add_argument("--seed", type=int, default=randomSeed)
+    args = parser.parse_args()
+    randomSeed = args.seed
+    suites = args.suites or ["parser", "mentions"]
+
+    print(f"Python version {sys.version}")
+    if "parser" in suites:
+        benchParser(args.messages)
+    if "mentions" in suites:
+        benchMentions()
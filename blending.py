@@ -0,0 +1,673 @@
+# Batched wheat blending, for planning many bin inventories at once
+#
+# blendWheat (see specialtopics.py-LinalgTemplate) reads one CSV of three bins and finds
+# the blend that is exactly proteinTarget % protein and moistureTarget % moisture.  Per
+# tonne of blend, the tonnes p taken from each bin solve
+#
+#     [ protein  ]       [ proteinTarget  ]
+#     [ moisture ] p  =  [ moistureTarget ]
+#     [ 1  1  1  ]       [ 1              ]
+#
+# and the blend is made until the first bin runs out, so the amount is the smallest
+# Weight / p over the bins that are used.
+#
+# Here the inventories are stacked into (N, 3) arrays and all N systems are solved with one
+# call to np.linalg.solve.  An inventory whose blend would need a negative amount from some
+# bin can't make the target at all and gets an amount of 0.  One whose bins don't pin down
+# a single blend (the matrix is singular) gets nan.
+#
+# Inventory files
+# ---------------
+# loadInventories streams a CSV of many inventories straight into numpy arrays, a chunk of
+# rows at a time.  It has the same columns as the bins files plus an optional Inventory
+# column naming the inventory each row belongs to (rows of one inventory must be next to
+# each other).  Every column other than Inventory, Bin and Weight is a quality column.
+# Bin and inventory names are interned into an index and rows refer to them by number.
+# Given a cacheDirectory the arrays are written there as they're read and memory-mapped,
+# so files with more rows than fit in memory can be loaded; openInventories maps them
+# back later without parsing the CSV again.
+#
+# General blends
+# --------------
+# BlendEngine handles any number of bins and any quality columns that have a target.  It
+# finds the most blend that can be made, as the linear program
+#
+#     maximise sum(x)  subject to  (quality - target) . x = 0 for every quality column,
+#                                  0 <= x <= Weight
+#
+# solved with the bounded-variable simplex method.  With three bins and two targets the
+# blend is fixed up to scale, so this gives the same answer as solveBlends.  The optimal
+# basis (and its inverse) is kept for each set of bin qualities and targets.  When only the
+# weights change the old basis is still dual feasible, so the dual simplex method starts
+# from it, and if it's still feasible a solve is a single matrix-vector product.
+#
+# What-if planning
+# ----------------
+# When there are as many bins as quality columns plus one, as in the bins files, the blend
+# matrix depends only on the bins' qualities.  BlendPlanner LU factorises it once for each
+# set of bins and answers questions about other targets or weights (any number at once)
+# with a forward and a back substitution.
+#
+# Live re-planning
+# ----------------
+# IncrementalBlend keeps a BlendEngine-style optimal blend up to date as bins are emptied
+# and refilled one at a time.  A weight is only a bound in the linear program, so the basis
+# and the reduced costs don't change with it.  A bin that has more than the blend takes
+# from it leaves the blend as it is.  Otherwise the bin's new amount (its weight if it's
+# worth using up, else 0) moves the basic amounts along one column of Binv M, a rank-one
+# update of the solution.  Only if that makes some amount go out of bounds is the dual
+# simplex method run, from the current basis.
+
+import csv
+import json
+import os
+import sys
+from collections import OrderedDict
+from itertools import islice
+
+import numpy as np
+
+proteinTarget = 14
+moistureTarget = 12.5
+
+# proportions this close to zero are treated as zero, so round-off doesn't make a bin
+# that isn't used look like it's the one that runs out (or that it's needed negatively)
+proportionTolerance = 1e-9
+
+# matrices whose |determinant| is this small next to the product of their row lengths
+# (which bounds it) are treated as singular.  Much cheaper than np.linalg.cond for big batches.
+singularRatio = 1e-12
+
+inventoryColumn, binColumn, weightColumn = 'Inventory', 'Bin', 'Weight'
+
+defaultTargets = { 'Protein': proteinTarget, 'Moisture': moistureTarget }
+
+# amounts and reduced costs this close to zero are treated as zero by the simplex method
+simplexTolerance = 1e-9
+
+
+def readBins(csvfilename):
+    '''Reads a bins CSV with columns Bin, Weight, Protein and Moisture.
+    Returns (names, weights, protein, moisture), with the last three as arrays.'''
+    with open(csvfilename, newline='') as f:
+        rows = list(csv.DictReader(f))
+    names = [ row['Bin'] for row in rows ]
+    weights, protein, moisture = np.array([ [ float(row[column]) for row in rows ] for column in ('Weight', 'Protein', 'Moisture') ])
+    return names, weights, protein, moisture
+
+
+def blendMatrices(protein, moisture):
+    '''Stacks the (N, 3) protein and moisture arrays into the (N, 3, 3) blend systems.'''
+    protein = np.asarray(protein, dtype=np.float64)
+    return np.stack([ protein, np.asarray(moisture, dtype=np.float64), np.ones_like(protein) ], axis=-2)
+
+
+def blendProportions(protein, moisture, targets=(proteinTarget, moistureTarget)):
+    '''The tonnes from each bin per tonne of blend, for (N, 3) arrays of bin protein and moisture.
+    Rows for singular systems are nan.'''
+    A = blendMatrices(protein, moisture)
+    singular = np.abs(np.linalg.det(A)) <= singularRatio * np.linalg.norm(A, axis=-1).prod(axis=-1)
+    A[singular] = np.eye(3)         # so the batched solve doesn't fail on them
+    b = np.array([ targets[0], targets[1], 1.0 ])
+    proportions = np.linalg.solve(A, np.broadcast_to(b, A.shape[:-1])[..., None])[..., 0]
+    proportions[singular] = np.nan
+    return proportions
+
+
+def cappedAmounts(proportions, weights):
+    '''How much blend each inventory makes before its first bin runs out.
+    0 for inventories that need a negative amount from some bin, nan for singular ones.'''
+    proportions = np.asarray(proportions)
+    weights = np.asarray(weights, dtype=np.float64)
+    used = proportions > proportionTolerance
+    ratios = np.divide(weights, proportions, out=np.full(proportions.shape, np.inf), where=used)
+    amounts = ratios.min(axis=-1)
+    amounts[(proportions < -proportionTolerance).any(axis=-1)] = 0.0
+    amounts[np.isnan(proportions).any(axis=-1)] = np.nan
+    return amounts
+
+
+def solveBlends(weights, protein, moisture, targets=(proteinTarget, moistureTarget)):
+    '''Solves every inventory in the (N, 3) arrays at once.
+    Returns (blends, amounts): the (N, 3) tonnes taken from each bin and the (N,) total amounts.'''
+    proportions = blendProportions(protein, moisture, targets)
+    amounts = cappedAmounts(proportions, weights)
+    blends = np.clip(proportions, 0.0, None) * amounts[:, None]
+    return blends, amounts
+
+
+def blendWheatBatch(inventories, targets=(proteinTarget, moistureTarget)):
+    '''blendWheat for many inventories at once.
+
+    inventories is a list of bins CSV filenames or of (names, weights, protein, moisture) tuples like readBins returns.
+    Returns a list of (blend, amount) pairs in the same order, where blend maps each bin name to the tonnes taken from it.
+    Amounts are rounded to 2 decimal places, like blendWheat's.'''
+    inventories = [ readBins(inventory) if isinstance(inventory, str) else inventory for inventory in inventories ]
+    if not inventories:
+        return []
+    names = [ inventory[0] for inventory in inventories ]
+    weights, protein, moisture = (np.array([ inventory[i] for inventory in inventories ], dtype=np.float64) for i in (1, 2, 3))
+    blends, amounts = solveBlends(weights, protein, moisture, targets)
+    blends, amounts = np.round(blends, 2).tolist(), np.round(amounts, 2).tolist()
+    return [ (dict(zip(binNames, blend)), amount) for binNames, blend, amount in zip(names, blends, amounts) ]
+
+
+#############################################
+# Loading inventory files
+
+class BinInventories:
+    '''The bins of many inventories, stored column by column.
+
+    Row r is bin binNames[binIds[r]], holding weights[r] tonnes with quality qualities[r, j] for each of columns.  The rows
+    of inventory i are offsets[i]:offsets[i + 1], and it's called inventoryNames[inventoryIds[i]].'''
+    def __init__(self, columns, binNames, binIds, weights, qualities, inventoryNames, inventoryIds, offsets):
+        self.columns = columns
+        self.binNames = binNames
+        self.binIds = binIds
+        self.weights = weights
+        self.qualities = qualities
+        self.inventoryNames = inventoryNames
+        self.inventoryIds = inventoryIds
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __repr__(self):
+        return f'BinInventories({len(self)} inventories, {len(self.weights)} bins, columns={self.columns})'
+
+    def column(self, name):
+        '''The values of quality column name for every row.'''
+        return self.qualities[:, self.columns.index(name)]
+
+    def inventoryName(self, i):
+        return self.inventoryNames[self.inventoryIds[i]]
+
+    def inventory(self, i):
+        '''Inventory i as (bin names, weights, qualities).'''
+        rows = slice(self.offsets[i], self.offsets[i + 1])
+        return [ self.binNames[b] for b in self.binIds[rows].tolist() ], self.weights[rows], self.qualities[rows]
+
+    def stacked(self):
+        '''(weights, qualities) as (N, k) and (N, k, columns) arrays, for when every inventory has the same number k of bins.'''
+        sizes = np.diff(self.offsets)
+        if len(sizes) == 0:
+            return self.weights.reshape(0, 0), self.qualities.reshape(0, 0, len(self.columns))
+        if (sizes != sizes[0]).any():
+            raise ValueError('inventories have different numbers of bins')
+        k = int(sizes[0])
+        return self.weights.reshape(-1, k), self.qualities.reshape(-1, k, len(self.columns))
+
+
+class NameIndex:
+    '''Numbers names in the order they're first seen.'''
+    def __init__(self):
+        self.ids = {}
+
+    def lookup(self, names):
+        '''The ids of an array of names, adding any new ones.'''
+        ids = self.ids
+        return np.array([ ids.setdefault(name, len(ids)) for name in names.tolist() ], dtype=np.int32)
+
+    def names(self):
+        '''The names in id order, interned so each is kept once however many inventories share it.'''
+        return tuple(map(sys.intern, self.ids))
+
+
+class ArraySink:
+    '''Collects the chunks of one array, in memory or appended to a file in cacheDirectory.'''
+    def __init__(self, dtype, cacheDirectory=None, filename=None, width=None):
+        self.dtype = np.dtype(dtype)
+        self.shape = () if width is None else (width,)
+        self.chunks = []
+        self.length = 0
+        self.path = None if cacheDirectory is None else os.path.join(cacheDirectory, filename)
+        self.file = None if self.path is None else open(self.path, 'wb')
+
+    def append(self, chunk):
+        chunk = np.ascontiguousarray(chunk, dtype=self.dtype)
+        self.length += len(chunk)
+        if self.file is None:
+            self.chunks.append(chunk)
+        else:
+            chunk.tofile(self.file)
+
+    def finish(self):
+        if self.file is None:
+            if not self.chunks:
+                return np.empty((0,) + self.shape, dtype=self.dtype)
+            return np.concatenate(self.chunks)
+        self.file.close()
+        return mapArray(self.path, self.dtype, (self.length,) + self.shape)
+
+
+def mapArray(path, dtype, shape):
+    if shape[0] == 0:       # np.memmap can't map an empty file
+        return np.empty(shape, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', shape=shape)
+
+
+# the files a cacheDirectory holds: (attribute, dtype, filename)
+cachedArrays = [ ('binIds', np.int32, 'binIds.i4'), ('weights', np.float64, 'weights.f8'),
+                 ('qualities', np.float64, 'qualities.f8'), ('inventoryIds', np.int32, 'inventoryIds.i4'),
+                 ('offsets', np.int64, 'offsets.i8') ]
+
+
+def loadInventories(csvfilename, chunkRows=1_000_000, cacheDirectory=None):
+    '''Reads an inventory CSV (see the top of this file) chunkRows rows at a time into a BinInventories.
+
+    With a cacheDirectory, the arrays are written to files there and memory-mapped instead of being kept in memory.
+    Without an Inventory column the whole file is one inventory, named after the file.'''
+    with open(csvfilename, newline='') as f:
+        header = [ name.strip() for name in next(csv.reader([ f.readline() ])) ]
+        for name in (binColumn, weightColumn):
+            if name not in header:
+                raise ValueError(f'{csvfilename} has no {name} column')
+        qualityColumns = [ name for name in header if name not in (inventoryColumn, binColumn, weightColumn) ]
+        # one pass over each chunk, with the names read as Python strings and everything else as floats
+        rowType = np.dtype([ (name, object if name in (inventoryColumn, binColumn) else np.float64) for name in header ])
+
+        if cacheDirectory is not None:
+            os.makedirs(cacheDirectory, exist_ok=True)
+        sinks = { attribute: ArraySink(dtype, cacheDirectory, filename, len(qualityColumns) if attribute == 'qualities' else None)
+                  for attribute, dtype, filename in cachedArrays }
+        binIndex, inventoryIndex = NameIndex(), NameIndex()
+        rows, lastInventory = 0, None
+        while True:
+            lines = list(islice(f, chunkRows))
+            if not lines:
+                break
+            if not any(line.strip() for line in lines):
+                continue    # nothing but blank lines, which loadtxt skips
+            chunk = np.loadtxt(lines, delimiter=',', dtype=rowType, ndmin=1, quotechar='"', comments=None)
+            sinks['binIds'].append(binIndex.lookup(chunk[binColumn]))
+            sinks['weights'].append(chunk[weightColumn])
+            sinks['qualities'].append(np.stack([ chunk[name] for name in qualityColumns ], axis=-1))
+            if inventoryColumn in header:
+                # inventory names are mostly all different, so only the first row of each is looked up
+                inventories = chunk[inventoryColumn]
+                starts = np.flatnonzero(inventories[1:] != inventories[:-1]) + 1
+                if inventories[0] != lastInventory:
+                    starts = np.concatenate([ [ 0 ], starts ])
+                sinks['inventoryIds'].append(inventoryIndex.lookup(inventories[starts]))
+                sinks['offsets'].append(starts + rows)
+                lastInventory = inventories[-1]
+            elif rows == 0:
+                inventoryIndex.lookup(np.array([ os.path.basename(csvfilename) ]))
+                sinks['inventoryIds'].append([ 0 ])
+                sinks['offsets'].append([ 0 ])
+            rows += len(chunk)
+        sinks['offsets'].append([ rows ])
+
+    columns = tuple(qualityColumns)
+    arrays = { attribute: sink.finish() for attribute, sink in sinks.items() }
+    if cacheDirectory is not None:
+        with open(os.path.join(cacheDirectory, 'inventories.json'), 'w') as f:
+            json.dump({ 'columns': columns, 'binNames': binIndex.names(), 'inventoryNames': inventoryIndex.names(),
+                        'rows': rows, 'inventories': len(arrays['inventoryIds']) }, f)
+    return BinInventories(columns, binIndex.names(), inventoryNames=inventoryIndex.names(), **arrays)
+
+
+def loadBins(csvfilename):
+    '''loadInventories for a bins CSV whose first inventory is the one wanted, checking there is one.'''
+    inventories = loadInventories(csvfilename)
+    if len(inventories) == 0:
+        raise ValueError(f'{csvfilename} has no bins')
+    return inventories
+
+
+def openInventories(cacheDirectory):
+    '''Memory-maps the BinInventories that loadInventories wrote to cacheDirectory.'''
+    with open(os.path.join(cacheDirectory, 'inventories.json')) as f:
+        metadata = json.load(f)
+    columns = tuple(metadata['columns'])
+    shapes = { 'binIds': (metadata['rows'],), 'weights': (metadata['rows'],), 'qualities': (metadata['rows'], len(columns)),
+               'inventoryIds': (metadata['inventories'],), 'offsets': (metadata['inventories'] + 1,) }
+    arrays = { attribute: mapArray(os.path.join(cacheDirectory, filename), dtype, shapes[attribute])
+               for attribute, dtype, filename in cachedArrays }
+    return BinInventories(columns, tuple(sys.intern(name) for name in metadata['binNames']),
+                          inventoryNames=tuple(sys.intern(name) for name in metadata['inventoryNames']), **arrays)
+
+
+def solveInventories(inventories, targets=(proteinTarget, moistureTarget)):
+    '''solveBlends for a BinInventories of three-bin inventories with Protein and Moisture columns.'''
+    weights, qualities = inventories.stacked()
+    protein = qualities[..., inventories.columns.index('Protein')]
+    moisture = qualities[..., inventories.columns.index('Moisture')]
+    return solveBlends(weights, protein, moisture, targets)
+
+
+#############################################
+# General blends
+
+def simplexBlend(A, upper, start=None):
+    '''Maximises sum(x) subject to A x = 0 and 0 <= x <= upper, with the bounded-variable simplex method.
+
+    Returns (x, basis, reused).  basis can be passed back as start for the same A with different upper bounds: it's
+    still dual feasible, so the dual simplex method carries on from it (often with no pivots at all), and reused is True.
+    Bland's rule picks the primal pivots, so degenerate problems can't cycle.'''
+    m, n = A.shape
+    M = np.hstack([ A, np.eye(m) ])       # an artificial variable for each row, held at 0
+    bounds = np.concatenate([ np.asarray(upper, dtype=np.float64), np.zeros(m) ])
+    cost = np.concatenate([ np.ones(n), np.zeros(m) ])
+    basis = None if start is None else dualSimplex(M, bounds, cost, start)
+    reused = basis is not None
+    if not reused:
+        basis = primalSimplex(M, bounds, cost, n)
+    x = basicSolution(M, bounds, *basis)
+    return np.clip(x[:n], 0.0, bounds[:n]), basis, reused
+
+
+def primalSimplex(M, bounds, cost, n):
+    '''The optimal basis (basic, atUpper, Binv), starting from all the bins empty and the artificials basic, which is
+    feasible since the right hand side is 0.'''
+    m = len(M)
+    basic = np.arange(n, n + m)
+    atUpper = np.zeros(n + m, dtype=bool)
+    Binv = np.eye(m)
+    enterable = np.zeros(n + m, dtype=bool)
+    for iteration in range(100 * (n + m)):
+        x = basicSolution(M, bounds, basic, atUpper, Binv)
+        reduced = cost - (cost[basic] @ Binv) @ M
+        enterable[:n] = True
+        enterable[basic] = False
+        improving = enterable & np.where(atUpper, reduced < -simplexTolerance, reduced > simplexTolerance)
+        if not improving.any():
+            return basic, atUpper, Binv
+
+        entering = np.flatnonzero(improving)[0]
+        direction = -1.0 if atUpper[entering] else 1.0
+        column = Binv @ M[:, entering]
+        change = -direction * column                        # how fast each basic variable moves
+        ratios = np.full(m, np.inf)
+        falling, rising = change < -simplexTolerance, change > simplexTolerance
+        ratios[falling] = x[basic][falling] / -change[falling]
+        ratios[rising] = (bounds[basic][rising] - x[basic][rising]) / change[rising]
+        step = ratios.min()
+        if bounds[entering] <= step:
+            # the entering variable reaches its other bound first, so the basis stays the same
+            atUpper[entering] = not atUpper[entering]
+            continue
+        ties = np.flatnonzero(ratios <= step + simplexTolerance)
+        row = ties[np.argmin(basic[ties])]
+        atUpper[basic[row]] = change[row] > 0
+        basic = basic.copy()
+        basic[row] = entering
+        Binv = pivotInverse(Binv, column, row)
+    raise RuntimeError('simplex method did not converge')
+
+
+def dualSimplex(M, bounds, cost, start):
+    '''The optimal basis, starting from a dual feasible one (an optimal basis for other bounds).
+    Returns None if it doesn't get there, so the caller can start again with the primal method.'''
+    basic, atUpper, Binv = start
+    basic = basic.copy()
+    m = len(M)
+    movable = bounds > simplexTolerance     # artificials and empty bins can't enter
+    # bins that were empty could have been left at either bound, put them on the side their reduced cost says
+    atUpper = nonbasicSides(cost - (cost[basic] @ Binv) @ M, atUpper)
+    for iteration in range(10 * (len(bounds))):
+        x = basicSolution(M, bounds, basic, atUpper, Binv)
+        below = -x[basic]
+        above = x[basic] - bounds[basic]
+        infeasibility = np.maximum(below, above)
+        row = infeasibility.argmax()
+        if infeasibility[row] <= simplexTolerance:
+            return basic, atUpper, Binv
+
+        # the basic variable in row moves to the bound it broke, a nonbasic variable that can push it there enters
+        alpha = Binv[row] @ M
+        if below[row] > 0:
+            eligible = np.where(atUpper, alpha > simplexTolerance, alpha < -simplexTolerance)
+        else:
+            eligible = np.where(atUpper, alpha < -simplexTolerance, alpha > simplexTolerance)
+        eligible &= movable
+        eligible[basic] = False
+        if not eligible.any():
+            return None
+        reduced = cost - (cost[basic] @ Binv) @ M
+        candidates = np.flatnonzero(eligible)
+        entering = candidates[np.argmin(np.abs(reduced[candidates] / alpha[candidates]))]
+        atUpper[basic[row]] = above[row] > 0
+        atUpper[entering] = False
+        basic[row] = entering
+        Binv = pivotInverse(Binv, Binv @ M[:, entering], row)
+    return None
+
+
+def nonbasicSides(reduced, atUpper):
+    '''Which bound each nonbasic variable should be at to be optimal: upper if increasing it helps, lower if decreasing it
+    does, and where it is now if neither.'''
+    return np.where(reduced > simplexTolerance, True, np.where(reduced < -simplexTolerance, False, atUpper))
+
+
+def pivotInverse(Binv, column, row):
+    '''The basis inverse after the variable basic in row is swapped for one whose column of Binv M is column.
+    A rank-one update of Binv, rather than inverting the new basis.'''
+    pivotRow = Binv[row] / column[row]
+    Binv = Binv - np.outer(column, pivotRow)
+    Binv[row] = pivotRow
+    return Binv
+
+
+def basicSolution(M, bounds, basic, atUpper, Binv):
+    '''The solution for a basis: nonbasic variables at the bound they're at, basic ones solving M x = 0.'''
+    x = np.where(atUpper, bounds, 0.0)
+    x[basic] = 0.0
+    x[basic] = -Binv @ (M @ x)
+    return x
+
+
+class BlendEngine:
+    '''Finds the most blend that can be made from any number of bins meeting a target for each quality column.
+
+    targets maps quality column names to their targets (defaultTargets if None).  Optimal bases are cached for up to
+    maxSize sets of bin qualities, least recently used first out.'''
+    def __init__(self, targets=None, maxSize=1024):
+        self.targets = dict(defaultTargets if targets is None else targets)
+        self.maxSize = maxSize
+        self.bases = OrderedDict()      # (shape, constraint matrix bytes) -> basis from simplexBlend
+        self.hits = 0
+        self.misses = 0
+
+    def constraints(self, qualities, columns):
+        '''The (columns, bins) constraint matrix, quality minus target for each bin.'''
+        missing = [ column for column in columns if column not in self.targets ]
+        if missing:
+            raise ValueError(f'no target for quality columns {missing}')
+        targets = np.array([ self.targets[column] for column in columns ], dtype=np.float64)
+        return np.ascontiguousarray((np.asarray(qualities, dtype=np.float64) - targets).T)
+
+    def solve(self, weights, qualities, columns=tuple(defaultTargets)):
+        '''(blend, amount) for one inventory, where qualities has a row per bin and a column for each of columns.'''
+        A = self.constraints(qualities, columns)
+        key = (A.shape, A.tobytes())
+        start = self.bases.get(key)
+        if start is not None:
+            self.bases.move_to_end(key)
+        blend, basis, reused = simplexBlend(A, weights, start)
+        if reused:
+            self.hits += 1
+        else:
+            self.misses += 1
+            self.bases[key] = basis
+            if len(self.bases) > self.maxSize:
+                self.bases.popitem(last=False)
+        return blend, blend.sum()
+
+    def blendInventory(self, inventories, i):
+        '''Inventory i of a BinInventories as (blend, amount) like blendWheat's, rounded to 2 decimal places.'''
+        names, weights, qualities = inventories.inventory(i)
+        blend, amount = self.solve(weights, qualities, inventories.columns)
+        return dict(zip(names, np.round(blend, 2).tolist())), round(float(amount), 2)
+
+    def blendAll(self, inventories):
+        return [ self.blendInventory(inventories, i) for i in range(len(inventories)) ]
+
+    def blendFile(self, csvfilename):
+        '''blendWheat for a bins CSV with any number of bins, and a quality column for each target.'''
+        return self.blendInventory(loadBins(csvfilename), 0)
+
+
+#############################################
+# What-if planning
+
+def luFactor(A):
+    '''LU factorisation with partial pivoting of a square matrix, P A = L U.
+    Returns (LU, pivots) with L below the diagonal of LU (its unit diagonal left out), or None if A is singular.'''
+    LU = np.array(A, dtype=np.float64)
+    n = len(LU)
+    pivots = np.arange(n)
+    scale = np.abs(LU).max(initial=0.0)
+    for k in range(n):
+        p = k + np.argmax(np.abs(LU[k:, k]))
+        if abs(LU[p, k]) <= singularRatio * scale:
+            return None
+        if p != k:
+            LU[[ k, p ]] = LU[[ p, k ]]
+            pivots[[ k, p ]] = pivots[[ p, k ]]
+        LU[k + 1:, k] /= LU[k, k]
+        LU[k + 1:, k + 1:] -= np.outer(LU[k + 1:, k], LU[k, k + 1:])
+    return LU, pivots
+
+
+def luSolve(factors, b):
+    '''Solves A x = b with luFactor's factors of A.  b can have a column for each of many right hand sides.'''
+    LU, pivots = factors
+    x = np.array(b, dtype=np.float64)[pivots]
+    n = len(LU)
+    for i in range(1, n):
+        x[i] -= LU[i, :i] @ x[:i]
+    for i in reversed(range(n)):
+        x[i] = (x[i] - LU[i, i + 1:] @ x[i + 1:]) / LU[i, i]
+    return x
+
+
+class BlendPlanner:
+    '''Answers what-if questions about blends from a set of bins with one more bin than quality columns.
+
+    The blend matrix (each quality column's row, then the mass balance row of ones) is LU factorised the first time a
+    set of bin qualities is seen, and kept for up to maxSize sets, least recently used first out.'''
+    def __init__(self, maxSize=256):
+        self.maxSize = maxSize
+        self.factors = OrderedDict()    # (shape, qualities bytes) -> luFactor of the blend matrix, None if singular
+        self.hits = 0
+        self.misses = 0
+
+    def factorisation(self, qualities):
+        '''luFactor of the blend matrix for bins with these qualities, a row per bin and a column per quality.'''
+        qualities = np.ascontiguousarray(qualities, dtype=np.float64)
+        bins, columns = qualities.shape
+        if bins != columns + 1:
+            raise ValueError(f'{bins} bins and {columns} quality columns don\'t make a square blend system, use a BlendEngine')
+        key = (qualities.shape, qualities.tobytes())
+        if key in self.factors:
+            self.hits += 1
+            self.factors.move_to_end(key)
+            return self.factors[key]
+        self.misses += 1
+        factors = self.factors[key] = luFactor(np.vstack([ qualities.T, np.ones(bins) ]))
+        if len(self.factors) > self.maxSize:
+            self.factors.popitem(last=False)
+        return factors
+
+    def proportions(self, qualities, targets=(proteinTarget, moistureTarget)):
+        '''The tonnes from each bin per tonne of blend, for one target per quality column or a (Q, columns) array of them.
+        nan if the bins don't pin down a single blend.'''
+        factors = self.factorisation(qualities)
+        targets = np.asarray(targets, dtype=np.float64)
+        b = np.concatenate([ np.atleast_2d(targets), np.ones((np.atleast_2d(targets).shape[0], 1)) ], axis=1).T
+        if factors is None:
+            proportions = np.full(b.T.shape, np.nan)
+        else:
+            proportions = luSolve(factors, b).T
+        return proportions if targets.ndim == 2 else proportions[0]
+
+    def plan(self, weights, qualities, targets=(proteinTarget, moistureTarget)):
+        '''(blends, amounts) for the bins with these qualities.  weights can be one weight per bin or a (Q, bins) array,
+        and targets one per column or (Q, columns), to answer Q what-if questions at once.'''
+        proportions = self.proportions(qualities, targets)
+        weights = np.asarray(weights, dtype=np.float64)
+        proportions, weights = np.broadcast_arrays(proportions, weights)
+        amounts = cappedAmounts(proportions.reshape(-1, proportions.shape[-1]), weights.reshape(-1, weights.shape[-1]))
+        amounts = amounts.reshape(proportions.shape[:-1])
+        return np.clip(proportions, 0.0, None) * amounts[..., None], amounts
+
+
+#############################################
+# Live re-planning
+
+class IncrementalBlend:
+    '''The most blend from a set of bins, kept up to date as their weights change one at a time.
+
+    qualities has a row per bin and a column for each of columns, and targets is as for BlendEngine.  names, if given,
+    lets bins be referred to by name.'''
+    def __init__(self, weights, qualities, columns=tuple(defaultTargets), targets=None, names=None):
+        self.names = None if names is None else list(names)
+        self.A = BlendEngine(targets).constraints(qualities, columns)
+        m, n = self.A.shape
+        self.M = np.hstack([ self.A, np.eye(m) ])
+        self.bounds = np.concatenate([ np.asarray(weights, dtype=np.float64), np.zeros(m) ])   # weights, then the artificials'
+        self.weights = self.bounds[:n]
+        blend, self.basis, _ = simplexBlend(self.A, self.weights)
+        self.x = basicSolution(self.M, self.bounds, *self.basis)
+        self.updates = 0        # weight changes handled without a simplex pivot
+        self.resolves = 0       # ones that needed the dual simplex method
+
+    @classmethod
+    def fromFile(cls, csvfilename, targets=None):
+        '''An IncrementalBlend for a bins CSV, with bins named as in the file.'''
+        inventories = loadBins(csvfilename)
+        names, weights, qualities = inventories.inventory(0)
+        return cls(weights, qualities, inventories.columns, targets, names)
+
+    @property
+    def blend(self):
+        return np.clip(self.x[:len(self.weights)], 0.0, self.weights)
+
+    @property
+    def amount(self):
+        return self.blend.sum()
+
+    def result(self):
+        '''(blend, amount) like blendWheat's, rounded to 2 decimal places.'''
+        names = range(len(self.weights)) if self.names is None else self.names
+        return dict(zip(names, np.round(self.blend, 2).tolist())), round(float(self.amount), 2)
+
+    def setWeight(self, bin, weight):
+        '''Changes the weight of one bin (by name or index) and returns the new (blend, amount).'''
+        k = self.names.index(bin) if isinstance(bin, str) else bin
+        self.weights[k] = weight
+        basic, atUpper, Binv = self.basis
+        if k in basic:
+            stillFits = self.x[k] <= weight + simplexTolerance
+        else:
+            # an unused bin stays empty, but one that was empty may now be worth using up, and a used up bin's new
+            # weight moves the basic amounts along its column to keep the targets
+            cost = np.concatenate([ np.ones(len(self.weights)), np.zeros(len(self.M)) ])
+            reduced = cost[k] - (cost[basic] @ Binv) @ self.M[:, k]
+            atUpper[k] = nonbasicSides(reduced, atUpper[k])
+            value = weight if atUpper[k] else 0.0
+            x = self.x[basic] - (Binv @ self.M[:, k]) * (value - self.x[k])
+            stillFits = (x >= -simplexTolerance).all() and (x <= self.bounds[basic] + simplexTolerance).all()
+            if stillFits:
+                self.x[basic] = x
+                self.x[k] = value
+        if stillFits:
+            self.updates += 1
+        else:
+            self.resolves += 1
+            blend, self.basis, _ = simplexBlend(self.A, self.weights, self.basis)
+            self.x = basicSolution(self.M, self.bounds, *self.basis)
+        return self.blend, self.amount
+
+if __name__ == '__main__':
+    import time
+    rng = np.random.default_rng(0)
+    N = 1_000_000
+    weights = rng.uniform(1, 30, size=(N, 3))
+    protein = rng.uniform(11, 17, size=(N, 3))
+    moisture = rng.uniform(11, 15, size=(N, 3))
+    start = time.perf_counter()
+    blends, amounts = solveBlends(weights, protein, moisture)
+    print(f'{N} inventories in {time.perf_counter() - start:.2f}s, {np.mean(amounts > 0):.1%} can make the target')
@@ -0,0 +1,250 @@
+# Vectorised Monte Carlo version of the crop insurance simulation in test_STA_probability.py
+#
+# doSomeFarming runs one year of one repeat at a time.  simulateFarming draws all of the
+# premiums, input costs, contract prices and crop failures for a block of repeats as numpy
+# arrays and works out the balances with array operations, so policies can be evaluated
+# over millions of simulated years.
+#
+# The simulation parameters (fields, payout rates, price ranges...) below are copies of the
+# ones in test_STA_probability.py, kept here so that importing this module (in every process
+# pool worker, too) doesn't run the grading harness.  test_farming.py checks they still
+# match.  Results are statistically the same as doSomeFarming's but not draw-for-draw
+# identical, since numpy's random generator is used instead of random's.
+#
+# Policies
+# --------
+# A batched policy is called once per year for a whole block of repeats:
+#
+#     insurance, state = policy(premiums, inputCost, contractPrice, lastYearOutcome, state)
+#
+# where premiums maps each insurance name to an array of premiums (one per repeat),
+# inputCost and contractPrice are arrays, lastYearOutcome is an array of crop failure names
+# (None in the first year) and state is whatever the policy returned last year (None in the
+# first year).  insurance is an array of insurance names, one per repeat, or a single name
+# for all of them.  (An array of indices into insuranceNames works too.)
+#
+# batched(chooseCropInsurance) turns a policy written like the one in specialtopics.py,
+# which handles one repeat at a time, into a batched one.  It still makes one call per
+# simulated year, so policies written for whole arrays are much faster.
+#
+# Marks depend on the seed, so evaluatePolicy runs the simulation for several independent
+# random streams across a process pool and merges the results, with a confidence interval
+# for the average profit.  Policies given to it must be picklable (defined at the top level
+# of a module, or made with batched or fixedPolicy).
+
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from statistics import NormalDist
+
+import numpy as np
+
+import probability
+
+repeats = 5000
+yearsPerRepeat = 20
+startingBalance = 0
+cropFailures = ( 'drought', 'hail', 'grasshoppers', 'no failure' )
+
+fields = {
+    'Home quarter': { 'drought': 4, 'hail': 1, 'grasshoppers': 1, 'no failure': 14 },
+    'Breaking':     { 'drought': 3, 'hail': 3, 'grasshoppers': 3, 'no failure': 11 },
+    'Lyon quarter': { 'drought': 0, 'hail': 4, 'grasshoppers': 0, 'no failure': 16 },
+    'Down south':   { 'drought': 1, 'hail': 1, 'grasshoppers': 3, 'no failure': 15 },
+    'Up north':     { 'drought': 2, 'hail': 2, 'grasshoppers': 2, 'no failure': 14 },
+    'The farm':     { 'drought': 1, 'hail': 1, 'grasshoppers': 1, 'no failure': 17 },
+}
+
+insurancePayoutRates = {
+    'comprehensive': { 'drought': 0.8, 'hail': 0.8, 'grasshoppers': 0.8, 'no failure': 1 },
+    'hail':          { 'drought': 0,   'hail': 0.8, 'grasshoppers': 0,   'no failure': 1 },
+    'grasshopper':   { 'drought': 0,   'hail': 0,   'grasshoppers': 0.8, 'no failure': 1 },
+    'basic':         { 'drought': 0.5, 'hail': 0,   'grasshoppers': 0.5, 'no failure': 1 },
+}
+
+premiumRanges = {
+    'comprehensive': (5000, 6000),
+    'hail':          (1900, 2100),
+    'grasshopper':   (1600, 1720),
+    'basic':         (2080, 2320),
+}
+
+inputCostRange =     (10000, 20000)
+contractPriceRange = (20000, 30000)
+
+insuranceNames = tuple(insurancePayoutRates)
+fieldNames = tuple(fields)
+
+# payoutRates[i, j] is what insurance i pays out, as a fraction of the contract price, for crop failure j
+payoutRates = np.array([ [ insurancePayoutRates[name][failure] for failure in cropFailures ] for name in insuranceNames ])
+
+failureNames = np.empty(len(cropFailures), dtype=object)   # for turning failure indices into names
+failureNames[:] = cropFailures
+
+
+def simulateFarming(policy, repeats=repeats, years=yearsPerRepeat, seed=0, blockSize=100_000):
+    '''Runs repeats farming careers of years years each with the batched policy, and returns an array with each repeat's profit.'''
+    rng = np.random.default_rng(seed)
+    # one alias sampler per field, for drawing crop failures weighted by how often they happen there
+    samplers = [ probability.AliasSampler(dict(zip(cropFailures, (fields[name][failure] for failure in cropFailures))), rng)
+                 for name in fieldNames ]
+    profits = np.empty(repeats, dtype=np.float64)
+    for start in range(0, repeats, blockSize):
+        block = min(blockSize, repeats - start)
+        profits[start:start + block] = simulateBlock(policy, block, years, rng, samplers)
+    return profits
+
+
+def simulateBlock(policy, block, years, rng, samplers):
+    '''Profits for one block of repeats, with everything drawn up front as (years, block) arrays.'''
+    field = rng.integers(len(samplers), size=block)
+    outcomes = np.empty((years, block), dtype=np.intp)
+    for f, sampler in enumerate(samplers):
+        onField = np.flatnonzero(field == f)
+        outcomes[:, onField] = sampler.drawIndices((years, len(onField)))
+    premiums = { name: rng.uniform(*premiumRanges[name], size=(years, block)) for name in insuranceNames }
+    premiumTable = np.stack([ premiums[name] for name in insuranceNames ])   # insurance x years x block
+    inputCost = rng.uniform(*inputCostRange, size=(years, block))
+    contractPrice = rng.uniform(*contractPriceRange, size=(years, block))
+
+    columns = np.arange(block)
+    balance = np.full(block, float(startingBalance))
+    state = None
+    lastYearOutcome = None
+    for year in range(years):
+        yearPremiums = { name: premiums[name][year] for name in insuranceNames }
+        insurance, state = policy(yearPremiums, inputCost[year], contractPrice[year], lastYearOutcome, state)
+        chosen = insuranceIndices(insurance, block)
+        outcome = outcomes[year]
+        balance += payoutRates[chosen, outcome] * contractPrice[year] - inputCost[year] - premiumTable[chosen, year, columns]
+        lastYearOutcome = failureNames[outcome]
+    return balance - startingBalance
+
+
+def insuranceIndices(insurance, block):
+    '''Turns a policy's array of insurance names (or a single name for every repeat) into indices into insuranceNames.
+    Policies can also return the indices themselves.'''
+    if isinstance(insurance, str):
+        if insurance not in insuranceNames:
+            raise ValueError(f'unknown insurance {insurance!r}, expected one of {insuranceNames}')
+        return np.full(block, insuranceNames.index(insurance), dtype=np.intp)
+    insurance = np.asarray(insurance)
+    if insurance.dtype.kind in 'iu':
+        return insurance
+    indices = np.full(block, -1, dtype=np.intp)
+    for i, name in enumerate(insuranceNames):
+        indices[insurance == name] = i
+    if (indices < 0).any():
+        raise ValueError(f'unknown insurance {insurance[indices < 0][0]!r}, expected one of {insuranceNames}')
+    return indices
+
+
+def averageProfit(policy, repeats=repeats, years=yearsPerRepeat, seed=0):
+    '''The vectorised equivalent of doSomeFarming: the average profit per repeat.'''
+    return simulateFarming(policy, repeats, years, seed).mean()
+
+
+class BatchedPolicy:
+    '''A batched policy made from one that handles one repeat at a time, see batched.'''
+    def __init__(self, chooseCropInsurance):
+        self.chooseCropInsurance = chooseCropInsurance
+
+    def __call__(self, premiums, inputCost, contractPrice, lastYearOutcome, states):
+        block = len(inputCost)
+        if states is None:
+            states = [ None ] * block
+        if lastYearOutcome is None:
+            lastYearOutcome = [ None ] * block
+        premiumLists = { name: values.tolist() for name, values in premiums.items() }
+        inputCost, contractPrice = inputCost.tolist(), contractPrice.tolist()
+        insurance = np.empty(block, dtype=object)
+        choose = self.chooseCropInsurance
+        for i in range(block):
+            repeatPremiums = { name: values[i] for name, values in premiumLists.items() }
+            insurance[i], states[i] = choose(repeatPremiums, inputCost[i], contractPrice[i], lastYearOutcome[i], states[i])
+        return insurance, states
+
+
+def batched(chooseCropInsurance):
+    '''Adapts a policy that handles one repeat at a time, like the chooseCropInsurance in specialtopics.py, into a batched policy.
+    Each repeat keeps its own state.'''
+    return BatchedPolicy(chooseCropInsurance)
+
+
+class FixedPolicy:
+    '''A batched policy that always buys the same insurance.'''
+    def __init__(self, name):
+        self.name = name
+
+    def __call__(self, premiums, inputCost, contractPrice, lastYearOutcome, state):
+        return self.name, state
+
+
+def fixedPolicy(name):
+    '''A batched policy that always buys insurance name.'''
+    return FixedPolicy(name)
+
+
+def cheapestPolicy(premiums, inputCost, contractPrice, lastYearOutcome, state):
+    '''A batched policy that buys whichever insurance has the lowest premium this year.'''
+    table = np.stack([ premiums[name] for name in insuranceNames ])
+    return np.array(insuranceNames)[table.argmin(axis=0)], state
+
+
+#############################################
+# Evaluating a policy over many seeds
+
+# mean and variance are of the profit per repeat over every repeat of every seed;
+# seedMeans holds the average profit for each seed on its own
+PolicyEvaluation = namedtuple('PolicyEvaluation', [ 'mean', 'variance', 'standardError', 'confidenceInterval', 'repeats', 'seedMeans' ])
+
+
+def seedStatistics(policy, seed, repeats, years):
+    '''Runs one seed and returns (count, mean, sum of squared deviations) of the profits, which is all that's needed to merge.'''
+    profits = simulateFarming(policy, repeats, years, seed)
+    mean = profits.mean()
+    return len(profits), mean, float(((profits - mean) ** 2).sum())
+
+
+def mergeStatistics(statistics):
+    '''Combines (count, mean, sum of squared deviations) triples with Chan et al.'s parallel update.'''
+    count, mean, squares = 0, 0.0, 0.0
+    for n, m, s in statistics:
+        total = count + n
+        delta = m - mean
+        mean += delta * n / total
+        squares += s + delta * delta * count * n / total
+        count = total
+    return count, mean, squares
+
+
+def evaluatePolicy(policy, seeds=8, repeats=repeats, years=yearsPerRepeat, processes=None, rootSeed=0, confidence=0.95):
+    '''Evaluates a batched policy over several seeds in parallel and returns a PolicyEvaluation.
+
+    seeds is either how many independent random streams to use (spawned from rootSeed, so they don't overlap) or a list of
+    seeds.  Each seed simulates repeats repeats in its own process; processes=1 runs everything in this process instead.'''
+    if isinstance(seeds, int):
+        seeds = np.random.SeedSequence(rootSeed).spawn(seeds)
+    seeds = list(seeds)
+    jobs = [ (policy, seed, repeats, years) for seed in seeds ]
+    if processes == 1:
+        statistics = [ seedStatistics(*job) for job in jobs ]
+    else:
+        with ProcessPoolExecutor(processes) as pool:
+            statistics = list(pool.map(seedStatistics, *zip(*jobs)))
+
+    count, mean, squares = mergeStatistics(statistics)
+    variance = squares / (count - 1) if count > 1 else 0.0
+    standardError = (variance / count) ** 0.5
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+    return PolicyEvaluation(mean, variance, standardError, (mean - z * standardError, mean + z * standardError), count,
+                            np.array([ m for _, m, _ in statistics ]))
+
+
+if __name__ == '__main__':
+    import time
+    for name in insuranceNames:
+        start = time.perf_counter()
+        result = evaluatePolicy(fixedPolicy(name), seeds=8, repeats=250_000)
+        low, high = result.confidenceInterval
+        print(f'always {name:<14} average profit {result.mean:8.0f}  95% CI ({low:.0f}, {high:.0f})  '
+              f'({time.perf_counter() - start:.2f}s for {result.repeats * yearsPerRepeat // 1_000_000}M simulated years)')
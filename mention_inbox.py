@@ -0,0 +1,73 @@
+#Mention notifications for reChat
+#Keeps "who mentioned me" cheap however long the history gets.  Every postChannel
+#or postDM action from the parser is recorded against each handle in its mentions
+#set.  Each handle keeps at most per_user recent mentions, entries older than ttl
+#seconds are dropped, and once more than max_users handles are tracked the least
+#recently mentioned one is forgotten.  Recording a mention is O(1).
+#
+#Use it straight after the parser:
+#
+#    action, state = ST.reChatParseCommand(message, state)
+#    inbox.record(action)
+
+import time
+from collections import OrderedDict, deque, namedtuple
+from itertools import islice
+
+# target is the channel or user the message was posted to, message_id is its id
+# in a MessageStore if there is one
+Mention = namedtuple('Mention', ['target', 'message_id', 'time'])
+
+# the action fields that say where a post went
+POST_TARGETS = {'postChannel': 'channel', 'postDM': 'user'}
+
+
+class MentionInbox:
+    def __init__(self, per_user=100, max_users=100000, ttl=None, clock=time.monotonic):
+        self.per_user = per_user
+        self.max_users = max_users
+        self.ttl = ttl              # seconds a mention is kept, None to keep until pushed out
+        self.clock = clock
+        self.inboxes = OrderedDict()  # handle -> deque of Mention, least recently mentioned first
+
+    def __len__(self):
+        return len(self.inboxes)
+
+    def record(self, action, message_id=None):
+        #records the mentions in a parser action, anything other than a post is ignored
+        target_field = POST_TARGETS.get(action.get('action'))
+        if target_field is None or not action['mentions']:
+            return
+        mention = Mention(action[target_field], message_id, self.clock())
+        for handle in action['mentions']:
+            self.add(handle, mention)
+
+    def add(self, handle, mention):
+        inbox = self.inboxes.get(handle)
+        if inbox is None:
+            inbox = self.inboxes[handle] = deque(maxlen=self.per_user)
+            if len(self.inboxes) > self.max_users:
+                self.inboxes.popitem(last=False)
+        else:
+            self.inboxes.move_to_end(handle)
+        inbox.append(mention)
+        self.expire(inbox, mention.time)
+
+    def expire(self, inbox, now):
+        #mentions are appended in time order, so expired ones are all at the front
+        if self.ttl is None:
+            return
+        cutoff = now - self.ttl
+        while inbox and inbox[0].time < cutoff:
+            inbox.popleft()
+
+    def mentions_of(self, handle, limit=None):
+        #the most recent mentions of handle, newest first
+        inbox = self.inboxes.get(handle)
+        if inbox is None:
+            return []
+        self.expire(inbox, self.clock())
+        if not inbox:
+            del self.inboxes[handle]
+            return []
+        return list(islice(reversed(inbox), limit))
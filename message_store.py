@@ -0,0 +1,90 @@
+#In-process message store for reChat
+#Channels and DM mailboxes are append-only ring buffers, so each one keeps its
+#most recent messages and old ones fall off the end.  Mentions are indexed from
+#handle to message id as messages are posted, and a message leaves the index when
+#it falls out of its ring.  Reads walk back from the newest message, so reading
+#k messages costs O(k) however long the history is.
+
+from collections import OrderedDict, deque, namedtuple
+from itertools import count, islice
+
+# target is the channel or the user the message was sent to
+StoredMessage = namedtuple('StoredMessage', ['id', 'target', 'message', 'mentions'])
+
+
+class MessageStore:
+    def __init__(self, channel_capacity=1000, mailbox_capacity=1000, mention_capacity=1000):
+        self.channel_capacity = channel_capacity
+        self.mailbox_capacity = mailbox_capacity
+        self.mention_capacity = mention_capacity
+        self.channels = {}      # channel -> deque of StoredMessage
+        self.mailboxes = {}     # username -> deque of StoredMessage
+        self.mentioned = {}     # username -> OrderedDict of stored message ids, oldest first
+        self.messages = {}      # message id -> StoredMessage, for everything still in a ring
+        self.users = set()      # every username seen in a DM or a mention
+        self.next_id = count(1)
+
+    def add_channel(self, channel):
+        return self.channels.setdefault(channel, deque())
+
+    def add_user(self, user):
+        self.users.add(user)
+
+    def post_channel(self, channel, message, mentions):
+        #returns the new message's id
+        return self.append(self.add_channel(channel), self.channel_capacity, channel, message, mentions)
+
+    def post_dm(self, user, message, mentions):
+        #returns the new message's id
+        self.users.add(user)
+        mailbox = self.mailboxes.setdefault(user, deque())
+        return self.append(mailbox, self.mailbox_capacity, user, message, mentions)
+
+    def append(self, ring, capacity, target, message, mentions):
+        stored = StoredMessage(next(self.next_id), target, message, frozenset(mentions))
+        if len(ring) >= capacity:
+            self.evict(ring.popleft())
+        ring.append(stored)
+        self.messages[stored.id] = stored
+        for handle in stored.mentions:
+            index = self.mentioned.get(handle)
+            if index is None:
+                index = self.mentioned[handle] = OrderedDict()
+                self.users.add(handle)
+            index[stored.id] = None
+            if len(index) > self.mention_capacity:
+                index.popitem(last=False)
+        return stored.id
+
+    def evict(self, stored):
+        #drops a message that fell out of its ring, and the handles that only it mentioned
+        del self.messages[stored.id]
+        for handle in stored.mentions:
+            index = self.mentioned.get(handle)
+            if index is not None:
+                index.pop(stored.id, None)
+                if not index:
+                    del self.mentioned[handle]
+
+    def read_channel(self, channel, limit=None):
+        #the last limit messages in the channel (all of them if limit is None), oldest first
+        return newest(self.channels.get(channel, ()), limit)
+
+    def read_dm(self, user, limit=None):
+        #the last limit messages sent to user, oldest first
+        return newest(self.mailboxes.get(user, ()), limit)
+
+    def mentions_of(self, handle, limit=None):
+        #the last limit messages that mention handle and are still stored, oldest first
+        ids = self.mentioned.get(handle, ())
+        found = [self.messages[message_id] for message_id in islice(reversed(ids), limit)]
+        found.reverse()
+        return found
+
+
+def newest(ring, limit):
+    if limit is None or limit >= len(ring):
+        return list(ring)
+    found = list(islice(reversed(ring), limit))
+    found.reverse()
+    return found
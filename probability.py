@@ -1,14 +1,295 @@
+import math
+from collections import OrderedDict
 
-def isProbDist(P):
-   '''Given a dictionary P with floats as values, returns True if P represents a probability distribution, otherwise False
+import numpy as np
+
+class Distribution:
+   '''A probability distribution stored as an index of outcomes and a contiguous float64 array of their probabilities.
+   Use it like a dictionary distribution with the functions below, or build one with Distribution.fromDict(P).
+
+   Events can be given as sets of outcomes, as boolean masks over the outcomes, or as arrays of outcome indices.
+   Outcomes in a set that aren't in the distribution are ignored.
+   '''
+   maskCacheSize = 256                                 # most event masks eventMask keeps, see eventMask
+
+   def __init__(self, outcomes, probs):
+      self.outcomes = tuple(outcomes)
+      self.index = { x: i for i, x in enumerate(self.outcomes) }  # outcome -> position in probs
+      self.probs = np.ascontiguousarray(probs, dtype=np.float64)
+      if self.probs.shape != (len(self.outcomes),):
+         raise ValueError('need exactly one probability per outcome')
+      self.masks = OrderedDict()                       # frozenset event -> mask, see eventMask
+      self.version = 0                                 # bumped whenever the probabilities change, see changed
+
+   @classmethod
+   def fromDict(cls, P):
+      '''Build a Distribution from a dictionary distribution'''
+      return cls(P.keys(), np.fromiter(P.values(), dtype=np.float64, count=len(P)))
+
+   def toDict(self):
+      return dict(zip(self.outcomes, self.probs.tolist()))
+
+   def __len__(self):
+      return len(self.outcomes)
+
+   def changed(self):
+      '''Call after changing probs in place, so caches (like ConditionalCache) know to recompute'''
+      self.version += 1
+
+   def setProbs(self, probs):
+      '''Replaces the probabilities of the outcomes'''
+      probs = np.ascontiguousarray(probs, dtype=np.float64)
+      if probs.shape != self.probs.shape:
+         raise ValueError('need exactly one probability per outcome')
+      self.probs = probs
+      self.changed()
+
+   def __repr__(self):
+      return f'Distribution({self.toDict()!r})'
+
+   def mask(self, E):
+      '''Returns event E as a boolean mask over the outcomes'''
+      if isinstance(E, np.ndarray) and E.dtype == np.bool_:
+         return E
+      mask = np.zeros(len(self.outcomes), dtype=np.bool_)
+      mask[self.indices(E)] = True
+      return mask
+
+   def indices(self, E):
+      '''Returns event E as an array of outcome indices'''
+      if isinstance(E, np.ndarray):
+         return np.flatnonzero(E) if E.dtype == np.bool_ else E
+      index = self.index
+      return np.fromiter((index[x] for x in E if x in index), dtype=np.intp)
+
+   def vector(self, f):
+      '''Returns a function on outcomes (a dictionary, or an array already in outcome order) as an array'''
+      if isinstance(f, np.ndarray):
+         return f
+      return np.fromiter((f[x] for x in self.outcomes), dtype=np.float64, count=len(self.outcomes))
+
+   def probEvent(self, E):
+      if isinstance(E, np.ndarray) and E.dtype == np.bool_:
+         return float(self.probs @ E)
+      return float(self.probs[self.indices(E)].sum())
+
+   def prob(self, *events):
+      mask = np.ones(len(self.outcomes), dtype=np.bool_)
+      for F in events:
+         mask &= self.mask(F)                    # intersection of events is AND of masks
+      return float(self.probs @ mask)
+
+   def eventMask(self, E):
+      '''Like mask, but the masks of the maskCacheSize most recently used sets of outcomes are remembered,
+      so an event that keeps turning up is only compiled once'''
+      if isinstance(E, np.ndarray):
+         return self.mask(E)
+      key = frozenset(E)
+      masks = self.masks
+      mask = masks.get(key)
+      if mask is None:
+         mask = masks[key] = self.mask(key)
+         if len(masks) > self.maskCacheSize:
+            masks.popitem(last=False)
+      else:
+         masks.move_to_end(key)
+      return mask
+
+   def probBatch(self, queries):
+      '''Returns an array holding prob(self, *query) for each query (a tuple of events) in queries.
+      Every distinct event is compiled to a mask once, then each query is an AND of masks and a dot product.'''
+      # the same event objects usually turn up in many queries, so their masks are looked up by id first.  The event is
+      # kept with its mask, so its id can't be reused by another event (from a generator, say) during the call.
+      rows = {}                                        # id of event -> (event, its mask)
+      def compiled(E):
+         row = rows.get(id(E))
+         if row is None:
+            row = rows[id(E)] = (E, self.eventMask(E))
+         return row[1]
+      queries = [ [ compiled(E) for E in query ] for query in queries ]
+
+      probs = self.probs
+      total = probs.sum()
+      joint = np.empty(len(self.outcomes), dtype=np.bool_)   # reused for every query, nothing is allocated per query
+      result = np.empty(len(queries), dtype=np.float64)
+      for q, masks in enumerate(queries):
+         if not masks:
+            result[q] = total
+            continue
+         if len(masks) == 1:
+            result[q] = probs @ masks[0]
+            continue
+         np.logical_and(masks[0], masks[1], out=joint)
+         for mask in masks[2:]:
+            joint &= mask
+         result[q] = probs @ joint
+      return result
+
+   def sampler(self, rng=None):
+      '''Returns an AliasSampler for drawing random outcomes from this distribution'''
+      return AliasSampler(self, rng)
+
+   def conditional(self, C):
+      '''Returns the Distribution conditioned on event C, or None if P(C) = 0'''
+      mask = self.mask(C)
+      p = self.probs @ mask
+      if p == 0: return None
+      return Distribution(self.outcomes, np.where(mask, self.probs / p, 0.0))
+
+   def conditionalProb(self, A, C):
+      mask = self.mask(C)
+      p = self.probs @ mask
+      if p == 0: return None
+      return float(self.probs @ (self.mask(A) & mask) / p)
+
+   def utility(self, utilityFunction):
+      return float(self.probs @ self.vector(utilityFunction))
+
+   def decide(self, utilityFunctions):
+      choices, U = utilityMatrix(utilityFunctions, self.outcomes)
+      utilities = U @ self.probs                       # expected utility of every choice in one matrix-vector product
+      best = int(utilities.argmax())
+      return choices[best], float(utilities[best])
+
+
+class LogDistribution:
+   '''A sparse probability distribution stored as log probabilities.
+   Only outcomes with non-zero probability are stored; any other outcome has probability 0.  Use it in place of a dictionary
+   distribution with probEvent, prob, conditionalProbDistribution, conditionalProb, posterior, utility and decide when the
+   outcome space is large and mostly zero, or when chained probabilities would underflow.
    '''
-   if any(p < 0 or p > 1 for p in P.values()):  # Are any of the values outside 0..1?
+   def __init__(self, logProbs):
+      self.logProbs = { x: lp for x, lp in logProbs.items() if lp != -math.inf }   # outcome -> log P(outcome)
+
+   @classmethod
+   def fromDict(cls, P):
+      '''Build a LogDistribution from a dictionary distribution, dropping outcomes with probability 0'''
+      return cls({ x: math.log(p) for x, p in P.items() if p > 0 })
+
+   def toDict(self):
+      return { x: math.exp(lp) for x, lp in self.logProbs.items() }
+
+   def __len__(self):
+      return len(self.logProbs)
+
+   def __repr__(self):
+      return f'LogDistribution({self.logProbs!r})'
+
+   def keys(self):
+      return self.logProbs.keys()
+
+   def logProbEvent(self, E):
+      '''Returns log P(E)'''
+      logProbs = self.logProbs
+      if len(E) <= len(logProbs):
+         logs = [ logProbs[x] for x in E if x in logProbs ]
+      else:
+         logs = [ lp for x, lp in logProbs.items() if x in E ]
+      return logSumExp(logs)
+
+   def probEvent(self, E):
+      return math.exp(self.logProbEvent(E))
+
+   def conditional(self, C):
+      '''Returns the LogDistribution conditioned on event C, or None if P(C) = 0'''
+      logC = self.logProbEvent(C)
+      if logC == -math.inf: return None
+      return LogDistribution({ x: lp - logC for x, lp in self.logProbs.items() if x in C })
+
+   def conditionalProb(self, A, C):
+      conditional = self.conditional(C)
+      if conditional is None: return None
+      return conditional.probEvent(A)
+
+   def utility(self, utilityFunction):
+      # outcomes that aren't stored have probability 0, so they add nothing
+      return math.fsum(math.exp(lp) * utilityFunction[x] for x, lp in self.logProbs.items())
+
+   def decide(self, utilityFunctions):
+      utilities = { choice: self.utility(utilFun) for choice, utilFun in utilityFunctions.items() }
+      bestChoice = max(utilities, key=utilities.get)
+      return bestChoice, utilities[bestChoice]
+
+class AliasSampler:
+   '''Draws random outcomes from a distribution using Walker's alias method.
+   Building the alias table takes O(n) once; after that each draw is O(1), and draws(n) gets n samples in one vectorised step.
+
+   P can be a dictionary, Distribution or LogDistribution.  A dictionary can hold weights that don't add up to 1, like the
+   weights given to random.choices.  rng is a numpy Generator or a seed for one, so that runs can be repeated exactly.
+   '''
+   def __init__(self, P, rng=None):
+      if isinstance(P, LogDistribution): P = P.toDict()
+      if isinstance(P, Distribution):
+         self.outcomes, weights = P.outcomes, P.probs
+      else:
+         self.outcomes = tuple(P.keys())
+         weights = np.fromiter(P.values(), dtype=np.float64, count=len(P))
+      total = weights.sum()
+      if len(weights) == 0 or weights.min() < 0 or not total > 0:
+         raise ValueError('need at least one outcome, no negative weights, and a positive total weight')
+      self.rng = np.random.default_rng(rng)
+      self.outcomeArray = np.empty(len(self.outcomes), dtype=object)   # for picking outcomes out by index array
+      self.outcomeArray[:] = self.outcomes
+      self.buildTable(weights * (len(weights) / total))
+
+   def buildTable(self, scaled):
+      '''Vose's construction.  Afterwards, slot i keeps outcome i with probability keep[i], and otherwise gives alias[i].'''
+      n = len(scaled)
+      keep = np.ones(n, dtype=np.float64)
+      alias = np.arange(n, dtype=np.intp)
+      small = [ i for i in range(n) if scaled[i] < 1 ]
+      large = [ i for i in range(n) if scaled[i] >= 1 ]
+      scaled = scaled.tolist()
+      while small and large:
+         s, l = small.pop(), large.pop()
+         keep[s] = scaled[s]
+         alias[s] = l
+         scaled[l] -= 1 - scaled[s]                   # l gives up the rest of slot s
+         (small if scaled[l] < 1 else large).append(l)
+      # anything left over is a full slot, up to rounding; keep stays 1
+      self.keep, self.alias = keep, alias
+      self.keepList, self.aliasList = keep.tolist(), alias.tolist()   # plain lists are faster for single draws
+
+   def draw(self):
+      '''Returns one random outcome'''
+      x = self.rng.random() * len(self.keepList)    # one random number gives both the slot and the coin flip
+      i = int(x)
+      return self.outcomes[i if x - i < self.keepList[i] else self.aliasList[i]]
+
+   def drawIndices(self, size):
+      '''Returns an array of size random outcome indices (positions in self.outcomes)'''
+      slots = self.rng.integers(0, len(self.keep), size=size)
+      return np.where(self.rng.random(size) < self.keep[slots], slots, self.alias[slots])
+
+   def draws(self, size):
+      '''Returns an array of size random outcomes'''
+      return self.outcomeArray[self.drawIndices(size)]
+
+def isProbDist(P, tolerance=1e-9):
+   '''Given a dictionary P with floats as values, returns True if P represents a probability distribution, otherwise False.
+   P can also be a Distribution or an array of probabilities.  The probabilities must add up to 1 to within tolerance.
+   '''
+   if isinstance(P, Distribution): P = P.probs
+   if isinstance(P, np.ndarray): return isProbArray(P, tolerance)
+   if not P: return False
+   values = P.values()
+   if min(values) < 0 or max(values) > 1:       # Are any of the values outside 0..1?
       return False
-   return sum(P.values()) == 1                  # sum of probabilities must be 1.
+   return abs(math.fsum(values) - 1) <= tolerance   # sum of probabilities must be 1.  fsum is exact, so rounding in the values can't add up
+
+def isProbArray(probs, tolerance=1e-9, blockSize=4096):
+   '''isProbDist for an array of probabilities'''
+   if probs.size == 0: return False
+   if probs.min() < 0 or probs.max() > 1:
+      return False
+   # numpy's pairwise sum is very accurate within each block, and fsum adds up the block totals exactly
+   blocks = np.add.reduceat(probs.ravel(), np.arange(0, probs.size, blockSize))
+   return abs(math.fsum(blocks) - 1) <= tolerance
 
 # We need some help to determine the probability of events from the probability distribution over outcomes
 def probEvent(P, E):
    '''Given a probability distribution P and a subset E of the possible outcomes (P.keys()), returns the probability of E'''
+   if isinstance(P, (Distribution, LogDistribution)): return P.probEvent(E)
    return sum(P[x] for x in E)                  # sum of the probabilities of all outcomes in E
 
 # some python magic!
@@ -18,6 +299,7 @@ def prob(P, *events):                           # the * here is called the splat
    
    prob(P, A, B, C)
    '''
+   if isinstance(P, Distribution): return P.prob(*events)
    # events is the list of all arguments after P.  Find the intersection of them all
    E = P.keys() # this is largest possible event.  
    for F in events:              
@@ -25,33 +307,191 @@ def prob(P, *events):                           # the * here is called the splat
                                                 # E is now the interesection of all events
    return probEvent(P, E)                       # Get the probability of the intersection
 
+def probBatch(P, queries):
+   '''Returns an array with prob(P, *query) for each query in queries, a sequence of tuples of events.  Called like so:
+
+   probBatch(P, [ (A, B), (A, C), (B,) ])
+
+   Much faster than calling prob for each query when there are many queries against the same distribution.'''
+   if not isinstance(P, Distribution): P = Distribution.fromDict(P)
+   return P.probBatch(queries)
+
 def conditionalProbDistribution(P, C):
    '''Returns the probability _distribution_ P(x | C) conditioned on an event C, or None if P(C) = 0'''
+   if isinstance(P, (Distribution, LogDistribution)): return P.conditional(C)
    p = probEvent(P, C)
    if p == 0 : return None                      # Can't divide by zero, so conditional probability not defined
-   return { x : px / p for x, px in P.items() } # Give a new distribution, conditioned on C
+   return { x : px / p if x in C else 0 for x, px in P.items() } # Give a new distribution, conditioned on C
 
 def conditionalProb(P, A, C):
    '''Returns the conditional probability P(A|C), or None if P(C) = 0''' 
+   if isinstance(P, (Distribution, LogDistribution)): return P.conditionalProb(A, C)
    p = probEvent(P, C)                          
    if p == 0: return None                       # Can't divide by zero, so conditional probability not defined
    return probEvent(P, A & C) / p                    # formula for P(A | C)
 
+def eventKey(E):
+   '''A hashable key for event E.  Sets of outcomes are keyed by the outcomes; masks and index arrays by their contents,
+   since frozenset of a mask is just {False, True}, which would mix all masks up (and with outcomes 0 and 1).'''
+   if isinstance(E, np.ndarray):
+      return (E.dtype.str, E.shape, E.tobytes())
+   return frozenset(E)
+
+class ConditionalCache:
+   '''Remembers conditional distributions, so conditioning the same distribution on the same event again is a lookup.
+
+   Entries are keyed on the distribution's identity and version and the event, and the least recently used ones are
+   dropped once there are more than maxSize.  A Distribution's version changes when its probabilities are changed (see
+   Distribution.changed), which makes its old entries unreachable.  Dictionaries don't have versions, so call
+   invalidate(P) after changing one.'''
+   def __init__(self, maxSize=1024):
+      self.maxSize = maxSize
+      self.entries = OrderedDict()                     # (id(P), version, eventKey(C)) -> (P, P( . | C) or None)
+      self.hits = 0
+      self.misses = 0
+
+   def __len__(self):
+      return len(self.entries)
+
+   def conditionalProbDistribution(self, P, C):
+      '''Same as conditionalProbDistribution(P, C), but cached.  Don't change the distribution returned.'''
+      C = C if isinstance(C, np.ndarray) else frozenset(C)
+      key = (id(P), getattr(P, 'version', 0), eventKey(C))
+      entry = self.entries.get(key)
+      if entry is not None:
+         self.hits += 1
+         self.entries.move_to_end(key)
+         return entry[1]
+      self.misses += 1
+      conditional = conditionalProbDistribution(P, C)
+      self.entries[key] = (P, conditional)             # holding on to P means its id can't be reused while cached
+      if len(self.entries) > self.maxSize:
+         self.entries.popitem(last=False)
+      return conditional
+
+   def conditionalProb(self, P, A, C):
+      '''Same as conditionalProb(P, A, C), but the distribution conditioned on C is cached'''
+      conditional = self.conditionalProbDistribution(P, C)
+      if conditional is None: return None
+      return prob(conditional, A)
+
+   def invalidate(self, P=None):
+      '''Forgets everything cached for distribution P, or everything if P is None'''
+      if P is None:
+         self.entries.clear()
+         return
+      for key in [ key for key, (cached, _) in self.entries.items() if cached is P ]:
+         del self.entries[key]
+
 def marginalLikelihood(prior, likelihood, E):
    '''Given a prior distribution over hypotheses prior, a likelihood function likelihood for outcomes based on hypotheses, and an event E, 
    retutrns the total liklihood of E'''
    # This is the sum over all H of P(E | H) * P(H)
    return sum(prob(likelihood[hypothesis], E) * probHypothesis for hypothesis, probHypothesis in prior.items() )
 
-def posterior(prior, likelihood, E):
+def logProb(P, *events):
+   '''Returns the log of prob(P, *events), -inf if it is 0'''
+   if isinstance(P, LogDistribution):
+      E = P.keys()
+      for F in events:
+         E = E & F
+      return P.logProbEvent(E)
+   p = prob(P, *events)
+   return math.log(p) if p > 0 else -math.inf
+
+def logMarginalLikelihood(prior, likelihood, E):
+   '''log of marginalLikelihood, worked out in log space so it doesn't underflow.  prior can be a dictionary or a LogDistribution.'''
+   logPrior = prior.logProbs if isinstance(prior, LogDistribution) else LogDistribution.fromDict(prior).logProbs
+   return logSumExp([ logProb(likelihood[hypothesis], E) + lp for hypothesis, lp in logPrior.items() ])
+
+def posterior(prior, likelihood, E, returnMarginal=False):
    '''Given a prior distribution over hypotheses prior, a likelihood function likelihood for outcomes based on hypotheses, and an event E, 
-   retutrns posterior distributon on hypotheses, i.e. the new probability distribution after Bayesian update.'''
+   retutrns posterior distributon on hypotheses, i.e. the new probability distribution after Bayesian update.
+   If returnMarginal is True, returns a pair (posterior, marginal likelihood of E) instead.
+   If prior is a LogDistribution, the update is done in log space: the posterior is a LogDistribution and the marginal likelihood
+   is returned as a log probability.'''
+   if isinstance(prior, LogDistribution): return logPosterior(prior, likelihood, E, returnMarginal)
    # Computes the distribution of P(H | E) = P(E | H) * P(H) / P(E)
-   return { hypothesis: prob(likelihood[hypothesis], E) * hypothesisProb / marginalLikelihood(prior, likelihood, E) 
-         for hypothesis, hypothesisProb in prior.items() }
+   # P(E | H) * P(H) is only worked out once per hypothesis, and P(E) is their sum
+   joint = { hypothesis: prob(likelihood[hypothesis], E) * hypothesisProb for hypothesis, hypothesisProb in prior.items() }
+   marginal = sum(joint.values())
+   result = { hypothesis: jointProb / marginal for hypothesis, jointProb in joint.items() }
+   if returnMarginal: return result, marginal
+   return result
+
+def logPosterior(prior, likelihood, E, returnMarginal=False):
+   '''posterior for a LogDistribution prior.  log P(H | E) = log P(E | H) + log P(H) - log P(E), with log P(E) from log-sum-exp.'''
+   logJoint = { hypothesis: logProb(likelihood[hypothesis], E) + lp for hypothesis, lp in prior.logProbs.items() }
+   logMarginal = logSumExp(list(logJoint.values()))
+   result = LogDistribution({ hypothesis: lj - logMarginal for hypothesis, lj in logJoint.items() })
+   if returnMarginal: return result, logMarginal
+   return result
+
+class BayesianUpdater:
+   '''Sequential Bayesian updating.  Give it a prior distribution over hypotheses and a likelihood function once, then call
+   update(E) for each event observed in turn.  The posterior is kept as an array of log probabilities and updated in place,
+   so long runs of small likelihoods don't underflow.
+
+   posterior gives the current posterior distribution, and marginalLikelihood (or logMarginalLikelihood) the total
+   likelihood of all events seen so far.'''
+   def __init__(self, prior, likelihood):
+      self.hypotheses = tuple(prior.keys())
+      self.likelihood = likelihood
+      if isinstance(prior, LogDistribution):
+         self.logPosterior = np.fromiter(prior.logProbs.values(), dtype=np.float64, count=len(prior))
+      else:
+         with np.errstate(divide='ignore'):          # log(0) = -inf is fine, that hypothesis is ruled out
+            self.logPosterior = np.log(np.fromiter(prior.values(), dtype=np.float64, count=len(prior)))
+      self.logMarginalLikelihood = 0.0
+      self.logLikelihoods = {}                       # eventKey(E) -> log P(E | H) for every H, as an array
+      self.scratch = np.empty_like(self.logPosterior)
+
+   def eventLogLikelihood(self, E):
+      '''log P(E | H) for every hypothesis.  Worked out once per distinct event, since the same few events keep recurring.'''
+      E = E if isinstance(E, np.ndarray) else frozenset(E)
+      key = eventKey(E)
+      logLikelihood = self.logLikelihoods.get(key)
+      if logLikelihood is None:
+         logLikelihood = self.logLikelihoods[key] = np.fromiter((logProb(self.likelihood[H], E) for H in self.hypotheses),
+                                                                dtype=np.float64, count=len(self.hypotheses))
+      return logLikelihood
+
+   def update(self, E):
+      '''Updates the posterior after observing event E.  Returns P(E) given everything observed before, or None if that is 0,
+      in which case nothing is changed.'''
+      logJoint = np.add(self.logPosterior, self.eventLogLikelihood(E), out=self.scratch)   # log P(E | H) P(H)
+      logEvidence = logSumExp(logJoint)
+      if logEvidence == -math.inf: return None      # E can't happen under any remaining hypothesis
+      np.subtract(logJoint, logEvidence, out=logJoint)
+      self.logPosterior, self.scratch = logJoint, self.logPosterior
+      self.logMarginalLikelihood += logEvidence
+      return math.exp(logEvidence)
+
+   def updateAll(self, events):
+      '''Updates the posterior with each event in turn'''
+      for E in events:
+         self.update(E)
+      return self
+
+   @property
+   def posterior(self):
+      return dict(zip(self.hypotheses, np.exp(self.logPosterior).tolist()))
+
+   @property
+   def marginalLikelihood(self):
+      return math.exp(self.logMarginalLikelihood)   # underflows to 0 over long runs, logMarginalLikelihood doesn't
+
+def logSumExp(logs):
+   '''Returns log(sum(exp(logs))) for an array of log values, without overflow or underflow'''
+   logs = np.asarray(logs, dtype=np.float64)
+   if logs.size == 0: return -math.inf
+   top = logs.max()
+   if not np.isfinite(top): return float(top)     # all -inf (or an inf/nan, which the sum can't fix)
+   return float(top + np.log(np.exp(logs - top).sum()))
 
 def utility(P, utilityFunction):
    '''Given a probability distribution P and a utility function utilityFunction, return the expected utility.'''
+   if isinstance(P, (Distribution, LogDistribution)): return P.utility(utilityFunction)
    # Computes the sum of u(x) * P(x)
    return sum(p * utilityFunction[x] for x, p in P.items())
 
@@ -61,6 +501,7 @@ def decide(P, utilityFunctions):
    utilityFunctions = { choice1: utilFun1, choice2: utilFun2, }
    returns a pair (choice, utility) where choice is the optimal choice (a key in the above dictionary) and utility its expected utility.
    '''
+   if isinstance(P, (Distribution, LogDistribution)): return P.decide(utilityFunctions)
    # Get the expected utility for each utility function
    utilities = { choice: utility(P, utilFun) for choice, utilFun in utilityFunctions.items() }
    # Find the utility function that gives the best expected utility
@@ -68,6 +509,45 @@ def decide(P, utilityFunctions):
    # Return the best choice and what it achieves
    return bestChoice, utilities[bestChoice]
 
+def utilityMatrix(utilityFunctions, outcomes):
+   '''Stacks a dictionary of utility functions (as for decide) into a choices x outcomes array.
+   Returns a pair (choices, U) where row i of U is the utility function for choices[i], in the order given by outcomes.
+   Utility functions can be dictionaries or arrays already in that order.'''
+   choices = list(utilityFunctions)
+   U = np.empty((len(choices), len(outcomes)), dtype=np.float64)
+   for row, choice in enumerate(choices):
+      utilFun = utilityFunctions[choice]
+      U[row] = utilFun if isinstance(utilFun, np.ndarray) else [ utilFun[x] for x in outcomes ]
+   return choices, U
+
+def probabilityMatrix(Ps, outcomes):
+   '''Stacks a sequence of distributions (dictionaries or Distributions) into a scenarios x outcomes array.
+   Outcomes missing from a distribution get probability 0.'''
+   if isinstance(Ps, np.ndarray): return Ps
+   P = np.zeros((len(Ps), len(outcomes)), dtype=np.float64)
+   for row, Q in enumerate(Ps):
+      if isinstance(Q, Distribution) and Q.outcomes == tuple(outcomes):
+         P[row] = Q.probs
+      else:
+         if isinstance(Q, Distribution): Q = Q.toDict()
+         P[row] = [ Q.get(x, 0) for x in outcomes ]
+   return P
+
+def decideBatch(Ps, utilityFunctions, outcomes=None):
+   '''Like decide, for a batch of probability distributions (scenarios) at once.
+   Ps is either a scenarios x outcomes array with one distribution per row, or a sequence of dictionaries or Distributions.
+   outcomes gives the order of the columns; by default it's the outcomes of the first distribution in Ps, or of the first
+   utility function if Ps is an array.
+   Returns a pair (choices, utilities), with the best choice for each scenario and an array of their expected utilities.'''
+   if outcomes is None:
+      if isinstance(Ps, np.ndarray) or len(Ps) == 0: first = next(iter(utilityFunctions.values()))
+      else: first = Ps[0]
+      outcomes = first.outcomes if isinstance(first, Distribution) else tuple(first)
+   choices, U = utilityMatrix(utilityFunctions, outcomes)
+   expected = probabilityMatrix(Ps, outcomes) @ U.T     # scenarios x choices expected utilities
+   best = expected.argmax(axis=1)                      # like max, ties go to the first choice
+   return [ choices[i] for i in best ], expected[np.arange(len(best)), best]
+
 
 if __name__ == "__main__":
    # Probability distributions are dictionaries with outcomes as keys and probabilities as values
@@ -0,0 +1,251 @@
+#reChat server front-end
+#Runs the reChat FSA from specialtopics.py over TCP.  Each connection gets its own
+#ChatSession, every line the client sends goes through the parser, and the action
+#that comes back is carried out against an in-memory MessageStore, with mentions
+#recorded in a MentionInbox.
+#
+#Every message from the client gets exactly one reply line, a JSON object holding
+#the action (with any results added), so clients can match replies to requests.
+#Lines longer than line_limit bytes are dropped and answered with an error.
+#
+#Run a server:       python rechat_server.py serve --port 8888
+#Load test locally:  python rechat_server.py loadtest --clients 10000
+#
+#An in-process load test needs a file descriptor for both ends of every
+#connection.  To go past half the open file limit, run the server on its own and
+#point the load test at it with --port.
+
+import argparse
+import asyncio
+import json
+import time
+
+import specialtopics as ST
+from mention_inbox import MentionInbox
+from message_store import MessageStore
+
+# longest line read from a connection, in bytes (asyncio's default is 64 KiB)
+LINE_LIMIT = 1024 * 1024
+TOO_LONG = {'error': 'Line too long'}
+
+
+class ReChatServer:
+    #carries out the actions returned by the parser
+    def __init__(self, store=None, inbox=None, read_limit=100, line_limit=LINE_LIMIT):
+        self.store = MessageStore() if store is None else store
+        self.inbox = MentionInbox() if inbox is None else inbox
+        self.read_limit = read_limit  # most messages sent back for one \read
+        self.line_limit = line_limit  # longest line accepted from a client, in bytes
+        self.connections = 0
+        # action name -> method that carries it out and returns the reply
+        self.performers = {
+            'list': self.perform_list,
+            'join': self.perform_join,
+            'dm': self.perform_dm,
+            'postChannel': self.perform_post_channel,
+            'postDM': self.perform_post_dm,
+            'readChannel': self.perform_read_channel,
+            'readDM': self.perform_read_dm,
+        }
+
+    def perform(self, action):
+        #anything without a performer (greeting, leave, quit, errors) is just echoed back
+        performer = self.performers.get(action.get('action'))
+        if performer is None:
+            return action
+        return performer(action)
+
+    def perform_list(self, action):
+        if action['param'] == 'channels':
+            items = self.store.channels.keys()
+        else:
+            items = self.store.users
+        return {**action, 'items': sorted(items)}
+
+    def perform_join(self, action):
+        self.store.add_channel(action['channel'])
+        return action
+
+    def perform_dm(self, action):
+        self.store.add_user(action['user'])
+        return action
+
+    def perform_post_channel(self, action):
+        message_id = self.store.post_channel(action['channel'], action['message'], action['mentions'])
+        self.inbox.record(action, message_id)
+        return action
+
+    def perform_post_dm(self, action):
+        message_id = self.store.post_dm(action['user'], action['message'], action['mentions'])
+        self.inbox.record(action, message_id)
+        return action
+
+    def perform_read_channel(self, action):
+        messages = self.store.read_channel(action['channel'], self.read_limit)
+        return {**action, 'messages': [stored.message for stored in messages]}
+
+    def perform_read_dm(self, action):
+        messages = self.store.read_dm(action['user'], self.read_limit)
+        return {**action, 'messages': [stored.message for stored in messages]}
+
+    async def handle_connection(self, reader, writer):
+        # the session holds this connection's ChatState, so there is no dict
+        # round trip per line like there would be with reChatParseCommand
+        session = ST.ChatSession()
+        self.connections += 1
+        try:
+            writer.write(encode_reply(self.perform(session.parse(''))))
+            while True:
+                line = await read_line(reader)
+                if line is None:
+                    # too long to parse, the state is left as it was
+                    writer.write(encode_reply(TOO_LONG))
+                    await writer.drain()
+                    continue
+                if not line:
+                    break
+                action = session.parse(line.decode('utf-8', 'replace').rstrip('\r\n'))
+                writer.write(encode_reply(self.perform(action)))
+                if action.get('action') == 'quit':
+                    break
+                await writer.drain()
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.connections -= 1
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def start(self, host='127.0.0.1', port=0, backlog=4096):
+        #returns the asyncio server; port 0 picks a free port
+        return await asyncio.start_server(self.handle_connection, host, port, backlog=backlog, limit=self.line_limit)
+
+
+async def read_line(reader):
+    #the next line, b'' at the end of input, or None for a line longer than the
+    #reader's limit, which is read and thrown away
+    too_long = False
+    while True:
+        try:
+            line = await reader.readuntil(b'\n')
+            return None if too_long else line
+        except asyncio.IncompleteReadError as error:
+            return None if too_long else error.partial
+        except asyncio.LimitOverrunError as error:
+            # drop what's buffered so far and keep going until the end of the line
+            await reader.readexactly(error.consumed)
+            too_long = True
+
+
+def encode_reply(reply):
+    #one JSON object per line, mention sets are sent as sorted lists
+    return (json.dumps(reply, default=sorted) + '\n').encode('utf-8')
+
+
+def server_port(server):
+    return server.sockets[0].getsockname()[1]
+
+
+#############################################
+# Loopback load test
+
+async def run_client(host, port, messages):
+    #sends each message in turn and waits for its reply, returns the replies
+    reader, writer = await asyncio.open_connection(host, port, limit=LINE_LIMIT)
+    replies = [json.loads(await reader.readline())]  # greeting
+    for message in messages:
+        writer.write((message + '\n').encode('utf-8'))
+        replies.append(json.loads(await reader.readline()))
+    writer.close()
+    await writer.wait_closed()
+    return replies
+
+
+def client_transcript(client):
+    #a typical session: look around, join a channel, talk, read, dm someone, quit
+    channel = f'#room{client % 100}'
+    user = f'@user{client}@example.com'
+    friend = f'@user{client + 1}@example.com'
+    return [
+        '\\list channels',
+        '\\join ' + channel,
+        f'Hello from {user}, are you there {friend}?',
+        '\\read',
+        '\\leave',
+        '\\dm ' + friend,
+        'Hi!',
+        '\\leave',
+        '\\quit',
+    ]
+
+
+async def load_test(clients, host='127.0.0.1', port=None, connect_batch=500):
+    #runs clients concurrent connections over loopback, against a server started
+    #here unless the port of a running one is given
+    server = None
+    if port is None:
+        server = await ReChatServer().start(host)
+        port = server_port(server)
+    start = time.perf_counter()
+    tasks = []
+    for client in range(clients):
+        tasks.append(asyncio.create_task(run_client(host, port, client_transcript(client))))
+        if len(tasks) % connect_batch == 0:
+            # let the pending connects through so the listen backlog doesn't overflow
+            await asyncio.sleep(0)
+    results = await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+    if server is not None:
+        server.close()
+        await server.wait_closed()
+    messages = sum(len(replies) for replies in results)
+    return messages, elapsed
+
+
+def raise_file_limit():
+    #every connection needs a file descriptor at each end, returns the new limit
+    try:
+        import resource
+    except ImportError:
+        return None
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    return hard
+
+
+async def serve_forever(host, port):
+    server = await ReChatServer().start(host, port)
+    print(f'reChat listening on {host}:{server_port(server)}')
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='reChat server')
+    commands = parser.add_subparsers(dest='command', required=True)
+    serve_parser = commands.add_parser('serve', help='run a server')
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=8888)
+    load_parser = commands.add_parser('loadtest', help='run a loopback load test')
+    load_parser.add_argument('--clients', type=int, default=10000)
+    load_parser.add_argument('--host', default='127.0.0.1')
+    load_parser.add_argument('--port', type=int, default=None,
+                             help='port of a running server (default: start one in this process)')
+    args = parser.parse_args()
+
+    limit = raise_file_limit()
+    if args.command == 'serve':
+        asyncio.run(serve_forever(args.host, args.port))
+    else:
+        needed = args.clients * (1 if args.port else 2) + 32
+        if limit is not None and needed > limit:
+            parser.exit(1, f'{args.clients} connections need about {needed} open files but the limit is {limit}; '
+                           'run the server separately and pass --port\n')
+        messages, elapsed = asyncio.run(load_test(args.clients, args.host, args.port))
+        print(f'{args.clients} connections, {messages} messages in {elapsed:.2f}s '
+              f'({messages / elapsed:.0f} messages/s)')
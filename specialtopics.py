@@ -3,13 +3,42 @@
 #CAB203 Assesment 3 - FSA Task
 
 import re
+import functools
+
+# modes are stored as small ints, MODE_NAMES gives the name used in state dicts
+COMMAND_MODE, CHANNEL_MODE, DM_MODE = 0, 1, 2
+MODE_NAMES = ('command', 'channel', 'dm')
+MODE_IDS = {'command': COMMAND_MODE, 'channel': CHANNEL_MODE, 'dm': DM_MODE}
 
 class ChatState:
     #current state
-    def __init__(self):
-        self.mode = 'command'  # Initial mode is command
-        self.current_channel = None
-        self.current_user = None
+    #immutable and slotted so one connection's state is small, and equal states
+    #can be shared between connections (see channel_state and dm_state)
+    __slots__ = ('mode_id', 'current_channel', 'current_user')
+
+    def __init__(self, mode_id=COMMAND_MODE, current_channel=None, current_user=None):
+        object.__setattr__(self, 'mode_id', mode_id)  # Initial mode is command
+        object.__setattr__(self, 'current_channel', current_channel)
+        object.__setattr__(self, 'current_user', current_user)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('ChatState is immutable')
+
+    def __eq__(self, other):
+        if not isinstance(other, ChatState):
+            return NotImplemented
+        return (self.mode_id, self.current_channel, self.current_user) == \
+            (other.mode_id, other.current_channel, other.current_user)
+
+    def __hash__(self):
+        return hash((self.mode_id, self.current_channel, self.current_user))
+
+    def __repr__(self):
+        return f'ChatState({self.mode!r}, {self.current_channel!r}, {self.current_user!r})'
+
+    @property
+    def mode(self):
+        return MODE_NAMES[self.mode_id]
     
     def to_dict(self):
         #make state dict
@@ -22,28 +51,54 @@ class ChatState:
     @classmethod
     def from_dict(cls, state_dict):
         if state_dict is None:
-            return cls()
+            return COMMAND_STATE
         
-        state = cls()
-        state.mode = state_dict.get('mode', 'command')
-        state.current_channel = state_dict.get('current_channel')
-        state.current_user = state_dict.get('current_user')
-        return state
+        mode_id = MODE_IDS[state_dict.get('mode', 'command')]
+        channel = state_dict.get('current_channel')
+        user = state_dict.get('current_user')
+        if mode_id == CHANNEL_MODE and user is None:
+            return channel_state(channel)
+        if mode_id == DM_MODE and channel is None:
+            return dm_state(user)
+        if mode_id == COMMAND_MODE and channel is None and user is None:
+            return COMMAND_STATE
+        return cls(mode_id, channel, user)
     
+    # ChatState is immutable, so these return the new state
     def enter_command_mode(self):
-        self.mode = 'command'
-        self.current_channel = None
-        self.current_user = None
+        return COMMAND_STATE
     
     def enter_channel_mode(self, channel):
-        self.mode = 'channel'
-        self.current_channel = channel
-        self.current_user = None
+        return channel_state(channel)
     
     def enter_dm_mode(self, user):
-        self.mode = 'dm'
-        self.current_user = user
-        self.current_channel = None
+        return dm_state(user)
+
+# shared state for every connection in command mode
+COMMAND_STATE = ChatState()
+
+# names longer than this are never cached, so a client sending huge junk names
+# can't pin lines of up to a megabyte in the caches
+CACHED_NAME_LENGTH = 256
+
+# states for popular channels and users are shared rather than rebuilt per message
+@functools.lru_cache(maxsize=4096)
+def shared_channel_state(channel):
+    return ChatState(CHANNEL_MODE, current_channel=channel)
+
+@functools.lru_cache(maxsize=4096)
+def shared_dm_state(user):
+    return ChatState(DM_MODE, current_user=user)
+
+def channel_state(channel):
+    if len(channel) > CACHED_NAME_LENGTH:
+        return ChatState(CHANNEL_MODE, current_channel=channel)
+    return shared_channel_state(channel)
+
+def dm_state(user):
+    if len(user) > CACHED_NAME_LENGTH:
+        return ChatState(DM_MODE, current_user=user)
+    return shared_dm_state(user)
 
 def is_valid_channel(channel):
     if not channel.startswith('#'):
@@ -58,107 +113,151 @@ def is_valid_channel(channel):
     
     return all(c.isalnum() for c in name)
 
-def is_valid_username(username):
+# Email pattern, matched against the whole username
+USERNAME_PATTERN = re.compile(r'@[a-z]+(?:\.[a-z]+)*@[a-z]+(?:\.[a-z]+)*(?:\.org|\.com)')
+
+def username_matches(username):
     #must start with @ and be valid
-    if not username.startswith('@'):
-        return False
-    
-    # part after @
-    email = username[1:]
-    
-    # Email pattern
-    pattern = r'[a-z]+(\.[a-z]+)*@[a-z]+(\.[a-z]+)*(\.org|\.com)'
-    return bool(re.match(pattern, email))
+    return USERNAME_PATTERN.fullmatch(username) is not None
+
+# the same few handles get mentioned over and over, so remember recent answers
+cached_username_matches = functools.lru_cache(maxsize=1024)(username_matches)
+
+def is_valid_username(username):
+    if len(username) > CACHED_NAME_LENGTH:
+        return username_matches(username)
+    return cached_username_matches(username)
+
+# a whole whitespace-separated word that is a valid username.  It starts with the
+# literal @ (checking the character before it afterwards) so the scan can jump
+# straight from one @ to the next
+MENTION_PATTERN = re.compile(r'@(?<!\S@)' + USERNAME_PATTERN.pattern[1:] + r'(?!\S)')
 
 def extract_mentions(message):
-    #@usernames returned as a set
-    words = message.split()
-    return {word for word in words if word.startswith('@') and is_valid_username(word)}
+    #@usernames returned as a set, found in one scan of the message
+    #(the pattern has no capturing groups, so findall gives the whole matches)
+    return set(MENTION_PATTERN.findall(message))
 
-def get_action(current_state, message):
-    # Handle commands
+# Command handlers.  Each one takes the current state and the text after the
+# command (None if there was none) and returns (action, next_state), or None
+# if the command isn't valid with that argument.
+
+def list_command(current_state, spec):
+    if spec in ('channels', 'users'):
+        return {'action': 'list', 'param': spec}, current_state
+
+def quit_command(current_state, arg):
+    return {'action': 'quit'}, current_state
+
+def join_command(current_state, channel):
+    if channel is not None and is_valid_channel(channel):
+        return {'action': 'join', 'channel': channel}, channel_state(channel)
+
+def dm_command(current_state, username):
+    if username is not None and is_valid_username(username):
+        return {'action': 'dm', 'user': username}, dm_state(username)
+
+def leave_channel_command(current_state, arg):
+    return {'action': 'leaveChannel', 'channel': current_state.current_channel}, COMMAND_STATE
+
+def read_channel_command(current_state, arg):
+    return {'action': 'readChannel', 'channel': current_state.current_channel}, current_state
+
+def leave_dm_command(current_state, arg):
+    return {'action': 'leaveDM', 'user': current_state.current_user}, COMMAND_STATE
+
+def read_dm_command(current_state, arg):
+    return {'action': 'readDM', 'user': current_state.current_user}, current_state
+
+def post_channel(current_state, message):
+    return {
+        'action': 'postChannel',
+        'channel': current_state.current_channel,
+        'message': message,
+        'mentions': extract_mentions(message)
+    }, current_state
+
+def post_dm(current_state, message):
+    return {
+        'action': 'postDM',
+        'user': current_state.current_user,
+        'message': message,
+        'mentions': extract_mentions(message)
+    }, current_state
+
+# FSA transition table, keyed by (mode, command).  Anything not in here is an
+# invalid command in that mode.
+COMMAND_TRANSITIONS = {
+    (COMMAND_MODE, 'list'): list_command,
+    (COMMAND_MODE, 'quit'): quit_command,
+    (COMMAND_MODE, 'join'): join_command,
+    (COMMAND_MODE, 'dm'): dm_command,
+    (CHANNEL_MODE, 'leave'): leave_channel_command,
+    (CHANNEL_MODE, 'read'): read_channel_command,
+    (DM_MODE, 'leave'): leave_dm_command,
+    (DM_MODE, 'read'): read_dm_command,
+}
+
+# messages that aren't commands, keyed by mode
+MESSAGE_TRANSITIONS = {
+    CHANNEL_MODE: post_channel,
+    DM_MODE: post_dm,
+}
+
+def parse_message(current_state, message):
+    #one parse of the message gives both the action and the next state
     if message.startswith('\\'):
-        parts = message[1:].split(' ', 1)
-        command = parts[0].lower()
-        if current_state.mode == 'command':
-            if command == 'list' and len(parts) > 1:
-                spec = parts[1]
-                if spec in ['channels', 'users']:
-                    return {'action': 'list', 'param': spec}
-            elif command == 'quit':
-                return {'action': 'quit'}
-            elif command == 'join' and len(parts) > 1:
-                channel = parts[1]
-                if is_valid_channel(channel):
-                    return {'action': 'join', 'channel': channel}
-            elif command == 'dm' and len(parts) > 1:
-                username = parts[1]
-                if is_valid_username(username):
-                    return {'action': 'dm', 'user': username}
-        elif current_state.mode == 'channel':
-            if command == 'leave':
-                return {'action': 'leaveChannel', 'channel': current_state.current_channel}
-            elif command == 'read':
-                return {'action': 'readChannel', 'channel': current_state.current_channel}
-        elif current_state.mode == 'dm':
-            if command == 'leave':
-                return {'action': 'leaveDM', 'user': current_state.current_user}
-            elif command == 'read':
-                return {'action': 'readDM', 'user': current_state.current_user}
+        command, space, arg = message[1:].partition(' ')
+        handler = COMMAND_TRANSITIONS.get((current_state.mode_id, command.lower()))
+        if not space:
+            arg = None
     else:
-        mentions = extract_mentions(message)
-        if current_state.mode == 'channel':
-            return {
-                'action': 'postChannel',
-                'channel': current_state.current_channel,
-                'message': message,
-                'mentions': mentions
-            }
-        elif current_state.mode == 'dm':
-            return {
-                'action': 'postDM',
-                'user': current_state.current_user,
-                'message': message,
-                'mentions': mentions
-            }
-    return {'error': 'Invalid command'}
+        handler = MESSAGE_TRANSITIONS.get(current_state.mode_id)
+        arg = message
+    result = handler and handler(current_state, arg)
+    if result is None:
+        # invalid commands leave the state alone
+        return {'error': 'Invalid command'}, current_state
+    return result
+
+def get_action(current_state, message):
+    action, _ = parse_message(current_state, message)
+    return action
 
 def get_next_state(current_state, message):
     #determines the next state based on current state and user input
-    if message.startswith('\\'):
-        parts = message[1:].split(' ', 1)
-        command = parts[0].lower()
-        
-        # Command mode transitions
-        if current_state.mode == 'command':
-            if command == 'join' and len(parts) > 1:
-                channel = parts[1]
-                if is_valid_channel(channel):
-                    current_state.enter_channel_mode(channel)
-            elif command == 'dm' and len(parts) > 1:
-                username = parts[1]
-                if is_valid_username(username):
-                    current_state.enter_dm_mode(username)
-        
-        # Channel mode transitions
-        elif current_state.mode == 'channel':
-            if command == 'leave':
-                current_state.enter_command_mode()
-        
-        # DM mode transitions
-        elif current_state.mode == 'dm':
-            if command == 'leave':
-                current_state.enter_command_mode()
-    
-    return current_state
+    _, next_state = parse_message(current_state, message)
+    return next_state
 
 def reChatParseCommand(message, state):
     # handle connection
     if message == '' and state is None:
-        return {'action': 'greeting'}, {'mode': 'command', 'current_channel': None, 'current_user': None}
-    chat_state = ChatState.from_dict(state)
-    action = get_action(chat_state, message)
-    if 'error' not in action:
-        chat_state = get_next_state(chat_state, message)
-    return action, chat_state.to_dict()
+        return {'action': 'greeting'}, COMMAND_STATE.to_dict()
+    action, next_state = parse_message(ChatState.from_dict(state), message)
+    return action, next_state.to_dict()
+
+class ChatSession:
+    #parser for one connection, keeps a live ChatState between messages
+    #instead of converting to and from a dict every time
+    def __init__(self, state=None):
+        #state can be a ChatState or the dict reChatParseCommand returns
+        if isinstance(state, dict):
+            state = ChatState.from_dict(state)
+        self.state = state  # None until the connection has been greeted
+
+    def parse(self, message):
+        if self.state is None:
+            self.state = COMMAND_STATE
+            if message == '':
+                return {'action': 'greeting'}
+        action, self.state = parse_message(self.state, message)
+        return action
+
+    def parse_all(self, messages):
+        #streams out the action for each message in order
+        for message in messages:
+            yield self.parse(message)
 
+def reChatParseMessages(messages, state=None):
+    #batch version of reChatParseCommand for a whole transcript from one connection
+    return ChatSession(state).parse_all(messages)
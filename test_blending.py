@@ -0,0 +1,324 @@
+import itertools
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+import blending as B
+
+scriptDirectory = os.path.dirname(__file__)
+
+# the expected blends from test_STA_linalg.py
+expectedBlends = {
+    'bins1.csv': ({'A': 12.0, 'B': 10.29, 'C': 3.43}, 25.71),
+    'bins2.csv': ({'Big one': 7.0, 'One beside the big one': 8.17, 'Old one': 2.33}, 17.5),
+    'bins3.csv': ({'A': 17.5, 'B': 15.0, 'C': 5.0}, 37.5),
+    'bins4.csv': ({'A': 14.0, 'B': 12.0, 'C': 4.0}, 30.0),
+    'bins5.csv': ({'A': 7.5, 'B': 15.0, 'C': 0.0}, 22.5),
+    'bins6.csv': ({'A': 3.5, 'B': 3.5, 'C': 7.0}, 14.0),
+    'bins7.csv': ({'A': 22.0, 'B': 8.25, 'C': 2.75}, 33.0),
+    'bins8.csv': ({'Bravo': 5.5, 'Charlie': 0.0, 'Alpha': 22.0}, 27.5),
+    'bins9.csv': ({'Top': 9.33, 'Middle': 2.67, 'Bottom': 4.0}, 16.0),
+}
+
+
+def binsPath(filename):
+    return os.path.join(scriptDirectory, filename)
+
+
+def assertBlendsMatch(test, expected, results):
+    for (expectedBlend, expectedAmount), (blend, amount) in zip(expected, results):
+        test.assertEqual(list(expectedBlend), list(blend))
+        for name in expectedBlend:
+            test.assertAlmostEqual(expectedBlend[name], blend[name], delta=0.01)
+        test.assertAlmostEqual(expectedAmount, amount, delta=0.01)
+
+
+class TestBlendWheatBatch(unittest.TestCase):
+    def test_bins_files(self):
+        results = B.blendWheatBatch([ binsPath(filename) for filename in expectedBlends ])
+        assertBlendsMatch(self, expectedBlends.values(), results)
+
+    def test_matches_one_at_a_time(self):
+        rng = np.random.default_rng(1)
+        weights = rng.uniform(1, 30, size=(500, 3))
+        protein = rng.uniform(11, 17, size=(500, 3))
+        moisture = rng.uniform(11, 15, size=(500, 3))
+        blends, amounts = B.solveBlends(weights, protein, moisture)
+        for i in range(500):
+            p = np.linalg.solve([ protein[i], moisture[i], [ 1, 1, 1 ] ], [ B.proteinTarget, B.moistureTarget, 1 ])
+            amount = min(weights[i] / p) if (p >= 0).all() else 0.0
+            self.assertAlmostEqual(amount, amounts[i])
+            if amount:
+                np.testing.assert_allclose(p * amount, blends[i], atol=1e-9)
+                self.assertTrue((blends[i] <= weights[i] + 1e-9).all())
+
+    def test_impossible_and_singular(self):
+        # every bin is drier than the target, and two bins that are the same
+        results = B.blendWheatBatch([
+            ([ 'A', 'B', 'C' ], [ 10, 10, 10 ], [ 15, 13, 12 ], [ 11, 11.5, 12 ]),
+            ([ 'A', 'B', 'C' ], [ 10, 10, 10 ], [ 15, 15, 12 ], [ 12, 12, 14 ]),
+        ])
+        self.assertEqual(({'A': 0.0, 'B': 0.0, 'C': 0.0}, 0.0), results[0])
+        self.assertTrue(np.isnan(results[1][1]))
+
+    def test_empty(self):
+        self.assertEqual([], B.blendWheatBatch([]))
+
+
+def writeInventoryFile(path):
+    '''Writes every bins file into one inventory CSV, with an Inventory column naming the file.'''
+    with open(path, 'w') as out:
+        out.write('Inventory,Bin,Weight,Protein,Moisture\n')
+        for filename in expectedBlends:
+            with open(binsPath(filename)) as f:
+                out.writelines(f'{filename},{line.strip()}\n' for line in list(f)[1:])
+
+
+class TestLoadInventories(unittest.TestCase):
+    def check(self, inventories):
+        self.assertEqual(len(expectedBlends), len(inventories))
+        self.assertEqual(('Protein', 'Moisture'), inventories.columns)
+        self.assertEqual(len(set(inventories.binNames)), len(inventories.binNames))
+        for i, filename in enumerate(expectedBlends):
+            self.assertEqual(filename, inventories.inventoryName(i))
+            names, weights, protein, moisture = B.readBins(binsPath(filename))
+            loadedNames, loadedWeights, qualities = inventories.inventory(i)
+            self.assertEqual(names, loadedNames)
+            np.testing.assert_array_equal(weights, loadedWeights)
+            np.testing.assert_array_equal(np.stack([ protein, moisture ], axis=-1), qualities)
+        blends, amounts = B.solveInventories(inventories)
+        np.testing.assert_allclose([ amount for _, amount in expectedBlends.values() ], amounts, atol=0.01)
+
+    def test_chunks(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'inventories.csv')
+            writeInventoryFile(path)
+            # chunk boundaries in the middle of inventories and between them
+            for chunkRows in (1, 2, 4, 1000):
+                self.check(B.loadInventories(path, chunkRows=chunkRows))
+
+    def test_memory_mapped(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path, cache = os.path.join(directory, 'inventories.csv'), os.path.join(directory, 'cache')
+            writeInventoryFile(path)
+            inventories = B.loadInventories(path, chunkRows=5, cacheDirectory=cache)
+            self.assertIsInstance(inventories.weights, np.memmap)
+            self.check(inventories)
+            self.check(B.openInventories(cache))
+
+    def test_single_inventory(self):
+        inventories = B.loadInventories(binsPath('bins2.csv'))
+        self.assertEqual(1, len(inventories))
+        self.assertEqual('bins2.csv', inventories.inventoryName(0))
+        self.assertEqual([ 'Big one', 'One beside the big one', 'Old one' ], inventories.inventory(0)[0])
+
+    def test_hash_in_names(self):
+        # # isn't a comment in a CSV
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'hash.csv')
+            with open(path, 'w') as f:
+                f.write('Inventory,Bin,Weight,Protein,Moisture\nSilo #2,Bin #1,12,15,12.5\nSilo #2,Bin #2,15,13.5,12\nSilo #2,#3,7,12,14\n')
+            inventories = B.loadInventories(path)
+            self.assertEqual('Silo #2', inventories.inventoryName(0))
+            self.assertEqual([ 'Bin #1', 'Bin #2', '#3' ], inventories.inventory(0)[0])
+            np.testing.assert_array_equal([ 12, 15, 7 ], inventories.inventory(0)[1])
+
+    def test_blank_lines(self):
+        # chunks that hold nothing but blank lines, with and without an Inventory column
+        with tempfile.TemporaryDirectory() as directory:
+            path, single = os.path.join(directory, 'inventories.csv'), os.path.join(directory, 'bins.csv')
+            with open(path, 'w') as out:
+                out.write('Inventory,Bin,Weight,Protein,Moisture\n\n')
+                for filename in expectedBlends:
+                    with open(binsPath(filename)) as f:
+                        out.writelines(f'{filename},{line.strip()}\n' for line in list(f)[1:])
+                    out.write('\n\n')
+            with open(single, 'w') as out, open(binsPath('bins2.csv')) as f:
+                header, *lines = list(f)
+                out.write(header + '\n\n' + '\n'.join(line.strip() for line in lines) + '\n\n')
+            for chunkRows in (1, 2, 3, 1000):
+                self.check(B.loadInventories(path, chunkRows=chunkRows))
+                inventories = B.loadInventories(single, chunkRows=chunkRows)
+                self.assertEqual(1, len(inventories))
+                self.assertEqual([ 'Big one', 'One beside the big one', 'Old one' ], inventories.inventory(0)[0])
+
+    def test_no_bins(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'empty.csv')
+            with open(path, 'w') as f:
+                f.write('Bin,Weight,Protein,Moisture\n\n')
+            self.assertEqual(0, len(B.loadInventories(path)))
+            with self.assertRaisesRegex(ValueError, 'no bins'):
+                B.BlendEngine().blendFile(path)
+            with self.assertRaisesRegex(ValueError, 'no bins'):
+                B.IncrementalBlend.fromFile(path)
+
+    def test_missing_column(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'bad.csv')
+            with open(path, 'w') as f:
+                f.write('Bin,Protein,Moisture\nA,15,12.5\n')
+            with self.assertRaises(ValueError):
+                B.loadInventories(path)
+
+
+def bruteForceBlend(A, upper):
+    '''The most blend, by trying every vertex of { x : A x = 0, 0 <= x <= upper }'''
+    m, n = A.shape
+    best = 0.0
+    for basic in itertools.combinations(range(n), m):
+        rest = [ j for j in range(n) if j not in basic ]
+        if abs(np.linalg.det(A[:, basic])) < 1e-12:
+            continue
+        for atUpper in itertools.product([ 0, 1 ], repeat=len(rest)):
+            x = np.zeros(n)
+            x[rest] = np.array(atUpper) * upper[rest]
+            x[list(basic)] = np.linalg.solve(A[:, basic], -A[:, rest] @ x[rest])
+            if (x >= -1e-9).all() and (x <= upper + 1e-9).all():
+                best = max(best, x.sum())
+    return best
+
+
+class TestBlendEngine(unittest.TestCase):
+    def test_bins_files(self):
+        engine = B.BlendEngine()
+        assertBlendsMatch(self, expectedBlends.values(), [ engine.blendFile(binsPath(filename)) for filename in expectedBlends ])
+
+    def test_inventory_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'inventories.csv')
+            writeInventoryFile(path)
+            assertBlendsMatch(self, expectedBlends.values(), B.BlendEngine().blendAll(B.loadInventories(path)))
+
+    def test_optimal(self):
+        rng = np.random.default_rng(2)
+        for trial in range(100):
+            n, m = rng.integers(3, 8), rng.integers(1, 4)
+            A, upper = rng.uniform(-3, 3, (m, n)), rng.uniform(0, 20, n)
+            x, basis, reused = B.simplexBlend(A, upper)
+            np.testing.assert_allclose(A @ x, 0, atol=1e-7)
+            self.assertTrue((x >= 0).all() and (x <= upper).all())
+            self.assertAlmostEqual(bruteForceBlend(A, upper), x.sum())
+
+    def test_warm_start(self):
+        rng = np.random.default_rng(3)
+        for trial in range(100):
+            n, m = rng.integers(3, 15), rng.integers(1, 5)
+            A, upper = rng.uniform(-3, 3, (m, n)), rng.uniform(0, 20, n)
+            x, basis, reused = B.simplexBlend(A, upper)
+            self.assertFalse(reused)
+            upper = upper * rng.uniform(0, 2, n)
+            upper[rng.integers(n)] = 0
+            warm, _, reused = B.simplexBlend(A, upper, basis)
+            cold, _, _ = B.simplexBlend(A, upper)
+            self.assertTrue((warm >= 0).all() and (warm <= upper).all())
+            self.assertAlmostEqual(cold.sum(), warm.sum())
+
+    def test_warm_start_refilled_bin(self):
+        # the dual simplex method can leave empty bins at either bound, and they have to be used once they're refilled
+        rng = np.random.default_rng(6)
+        for trial in range(100):
+            n, m = rng.integers(3, 15), rng.integers(1, 5)
+            A, upper = rng.uniform(-3, 3, (m, n)), rng.uniform(0, 20, n)
+            _, basis, _ = B.simplexBlend(A, upper)
+            for step in range(20):
+                upper = upper.copy()
+                upper[rng.integers(n)] = 0 if rng.random() < 0.3 else rng.uniform(0, 20)
+                warm, basis, _ = B.simplexBlend(A, upper, basis)
+                self.assertAlmostEqual(B.simplexBlend(A, upper)[0].sum(), warm.sum())
+
+    def test_cache(self):
+        engine = B.BlendEngine(maxSize=2)
+        inventories = [ B.readBins(binsPath(filename)) for filename in ('bins1.csv', 'bins2.csv', 'bins5.csv') ]
+        for names, weights, protein, moisture in inventories + inventories[2:]:
+            engine.solve(weights, np.stack([ protein, moisture ], axis=-1))
+        self.assertEqual((1, 3, 2), (engine.hits, engine.misses, len(engine.bases)))
+
+    def test_more_bins_and_columns(self):
+        # a fourth bin and a gluten column, with a target met by everything but bin D
+        engine = B.BlendEngine(targets={ 'Protein': 14, 'Moisture': 12.5, 'Gluten': 30 })
+        qualities = np.array([ [ 15, 12.5, 30 ], [ 13.5, 12, 30 ], [ 12, 14, 30 ], [ 14, 12.5, 35 ] ])
+        blend, amount = engine.solve([ 12, 15, 7, 50 ], qualities, ('Protein', 'Moisture', 'Gluten'))
+        np.testing.assert_allclose([ 12, 10.29, 3.43, 0 ], blend, atol=0.01)
+        with self.assertRaises(ValueError):
+            engine.solve([ 12, 15, 7 ], qualities[:3], ('Protein', 'Moisture', 'Ash'))
+
+
+class TestBlendPlanner(unittest.TestCase):
+    def test_bins_files(self):
+        planner = B.BlendPlanner()
+        for filename, (expectedBlend, expectedAmount) in expectedBlends.items():
+            names, weights, protein, moisture = B.readBins(binsPath(filename))
+            blend, amount = planner.plan(weights, np.stack([ protein, moisture ], axis=-1))
+            assertBlendsMatch(self, [ (expectedBlend, expectedAmount) ], [ (dict(zip(names, blend)), amount) ])
+
+    def test_what_if(self):
+        planner = B.BlendPlanner()
+        names, weights, protein, moisture = B.readBins(binsPath('bins1.csv'))
+        qualities = np.stack([ protein, moisture ], axis=-1)
+        rng = np.random.default_rng(4)
+        targets = np.stack([ rng.uniform(12, 15, 50), rng.uniform(12, 14, 50) ], axis=-1)
+        allWeights = rng.uniform(0, 30, (50, 3))
+        blends, amounts = planner.plan(allWeights, qualities, targets)
+        self.assertEqual((50, 3), blends.shape)
+        for i in range(50):
+            expectedBlends, expectedAmounts = B.solveBlends(allWeights[i:i + 1], protein[None], moisture[None], targets[i])
+            np.testing.assert_allclose(expectedBlends[0], blends[i], atol=1e-9)
+            self.assertAlmostEqual(expectedAmounts[0], amounts[i])
+        # only one factorisation for all of them
+        self.assertEqual((0, 1), (planner.hits, planner.misses))
+        blends, amounts = planner.plan(weights, qualities, targets)
+        self.assertEqual((50,), amounts.shape)
+        self.assertEqual((1, 1), (planner.hits, planner.misses))
+
+    def test_cache_and_singular(self):
+        planner = B.BlendPlanner(maxSize=1)
+        singular = np.array([ [ 15, 12 ], [ 15, 12 ], [ 12, 14 ] ])
+        blend, amount = planner.plan([ 10, 10, 10 ], singular)
+        self.assertTrue(np.isnan(amount))
+        planner.plan([ 10, 10, 10 ], [ [ 15, 12.5 ], [ 13.5, 12 ], [ 12, 14 ] ])
+        planner.plan([ 10, 10, 10 ], singular)
+        self.assertEqual((0, 3, 1), (planner.hits, planner.misses, len(planner.factors)))
+        with self.assertRaises(ValueError):
+            planner.plan([ 10, 10 ], [ [ 15, 12.5 ], [ 13.5, 12 ] ])
+
+    def test_lu(self):
+        rng = np.random.default_rng(5)
+        A = rng.uniform(-5, 5, (20, 20))
+        b = rng.uniform(size=(20, 4))
+        np.testing.assert_allclose(np.linalg.solve(A, b), B.luSolve(B.luFactor(A), b))
+        np.testing.assert_allclose(np.linalg.solve(A, b[:, 0]), B.luSolve(B.luFactor(A), b[:, 0]))
+        self.assertIsNone(B.luFactor([ [ 1, 2 ], [ 2, 4 ] ]))
+
+
+class TestIncrementalBlend(unittest.TestCase):
+    def test_bins_files(self):
+        # bins1, bins3 and bins4 are the same bins with different weights
+        blend = B.IncrementalBlend.fromFile(binsPath('bins1.csv'))
+        assertBlendsMatch(self, [ expectedBlends['bins1.csv'] ], [ blend.result() ])
+        blend.setWeight('A', 22)
+        blend.setWeight('C', 27)
+        assertBlendsMatch(self, [ expectedBlends['bins3.csv'] ], [ blend.result() ])
+        blend.setWeight('C', 4)
+        assertBlendsMatch(self, [ expectedBlends['bins4.csv'] ], [ blend.result() ])
+
+    def test_matches_full_solve(self):
+        rng = np.random.default_rng(7)
+        for n, m in ((3, 2), (8, 2), (25, 4)):
+            columns = tuple(f'q{j}' for j in range(m))
+            blend = B.IncrementalBlend(rng.uniform(1, 30, n), rng.uniform(-3, 3, (n, m)), columns, dict.fromkeys(columns, 0))
+            for step in range(300):
+                k = rng.integers(n)
+                weight = 0.0 if rng.random() < 0.1 else max(0.0, blend.weights[k] + rng.normal(0, 5))
+                x, amount = blend.setWeight(k, weight)
+                np.testing.assert_allclose(blend.A @ x, 0, atol=1e-7)
+                self.assertTrue((x >= 0).all() and (x <= blend.weights).all())
+                self.assertAlmostEqual(B.simplexBlend(blend.A, blend.weights)[0].sum(), amount)
+            self.assertEqual(300, blend.updates + blend.resolves)
+            self.assertGreater(blend.updates, blend.resolves)
+
+
+if __name__ == '__main__':
+    unittest.main()
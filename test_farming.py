@@ -0,0 +1,85 @@
+import unittest
+
+import numpy as np
+
+import farming as F
+
+
+def expectedProfit(name):
+    '''Exact expected profit for always buying insurance name'''
+    payout = np.mean([ sum(field[failure] / sum(field.values()) * F.insurancePayoutRates[name][failure] for failure in F.cropFailures)
+                       for field in F.fields.values() ])
+    perYear = payout * np.mean(F.contractPriceRange) - np.mean(F.inputCostRange) - np.mean(F.premiumRanges[name])
+    return perYear * F.yearsPerRepeat
+
+
+def alternating(premiums, inputCost, contractPrice, lastYearOutcome, state):
+    '''A one-repeat-at-a-time policy: hail one year, basic the next, then hail after any drought'''
+    if lastYearOutcome == 'drought':
+        return 'hail', 'hail'
+    insurance = 'basic' if state == 'hail' else 'hail'
+    return insurance, insurance
+
+
+def alternatingBatch(premiums, inputCost, contractPrice, lastYearOutcome, state):
+    '''alternating, written for whole arrays'''
+    if state is None:
+        state = np.full(len(inputCost), 'basic')
+    insurance = np.where(state == 'hail', 'basic', 'hail')
+    if lastYearOutcome is not None:
+        insurance[lastYearOutcome == 'drought'] = 'hail'
+    return insurance, insurance
+
+
+class TestFarming(unittest.TestCase):
+    def test_parameters_match_harness(self):
+        import test_STA_probability as harness
+        for name in ('repeats', 'yearsPerRepeat', 'startingBalance', 'cropFailures', 'fields', 'insurancePayoutRates',
+                     'premiumRanges', 'inputCostRange', 'contractPriceRange'):
+            self.assertEqual(getattr(harness, name), getattr(F, name), name)
+
+    def test_fixed_policies(self):
+        for name in F.insuranceNames:
+            profits = F.simulateFarming(F.fixedPolicy(name), repeats=200_000, blockSize=30_000)
+            standardError = profits.std() / np.sqrt(len(profits))
+            self.assertAlmostEqual(expectedProfit(name), profits.mean(), delta=4 * standardError)
+
+    def test_batched_adapter(self):
+        scalar = F.simulateFarming(F.batched(alternating), repeats=500, seed=3)
+        vectorised = F.simulateFarming(alternatingBatch, repeats=500, seed=3)
+        np.testing.assert_allclose(vectorised, scalar)
+
+    def test_seeded(self):
+        np.testing.assert_array_equal(F.simulateFarming(F.cheapestPolicy, repeats=1000, seed=9),
+                                      F.simulateFarming(F.cheapestPolicy, repeats=1000, seed=9))
+        self.assertEqual(F.averageProfit(F.fixedPolicy('grasshopper'), repeats=1000, seed=9),
+                         F.averageProfit(F.cheapestPolicy, repeats=1000, seed=9))
+
+    def test_unknown_insurance(self):
+        with self.assertRaises(ValueError):
+            F.simulateFarming(F.fixedPolicy('flood'), repeats=10)
+        with self.assertRaises(ValueError):
+            F.simulateFarming(lambda *args: (np.array([ 'hail', 'flood' ] * 5), None), repeats=10)
+
+
+class TestEvaluatePolicy(unittest.TestCase):
+    def test_merge_matches_serial(self):
+        seeds = np.random.SeedSequence(1).spawn(4)
+        profits = np.concatenate([ F.simulateFarming(F.cheapestPolicy, repeats=3000, seed=seed) for seed in seeds ])
+        result = F.evaluatePolicy(F.cheapestPolicy, seeds=4, repeats=3000, rootSeed=1, processes=2)
+        self.assertEqual(12000, result.repeats)
+        self.assertAlmostEqual(profits.mean(), result.mean, delta=1e-6)
+        self.assertAlmostEqual(profits.var(ddof=1), result.variance, delta=1e-3)
+        low, high = result.confidenceInterval
+        self.assertAlmostEqual(1.96 * profits.std(ddof=1) / np.sqrt(12000), high - result.mean, delta=1)
+        self.assertAlmostEqual(result.mean, result.seedMeans.mean(), delta=1e-6)
+
+    def test_in_process_and_explicit_seeds(self):
+        inProcess = F.evaluatePolicy(F.batched(alternating), seeds=[ 5, 6 ], repeats=200, processes=1)
+        pooled = F.evaluatePolicy(F.batched(alternating), seeds=[ 5, 6 ], repeats=200, processes=2)
+        self.assertEqual(inProcess[:5], pooled[:5])
+        np.testing.assert_array_equal(inProcess.seedMeans, pooled.seedMeans)
+
+
+if __name__ == '__main__':
+    unittest.main()
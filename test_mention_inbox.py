@@ -0,0 +1,63 @@
+import unittest
+
+import specialtopics as ST
+from mention_inbox import MentionInbox
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def post(channel, message):
+    '''The action the parser gives for message posted in channel.'''
+    action, _ = ST.reChatParseCommand(message, {"mode": "channel", "current_channel": channel})
+    return action
+
+
+class TestMentionInbox(unittest.TestCase):
+    def test_records_parser_actions(self):
+        inbox = MentionInbox()
+        inbox.record(post("#a", "hi @x@y.com and @z@y.org"), message_id=7)
+        inbox.record(post("#b", "no mentions here"))
+        inbox.record({"action": "quit"})
+        inbox.record({"error": "Invalid command"})
+        self.assertEqual([("#a", 7)], [(m.target, m.message_id) for m in inbox.mentions_of("@x@y.com")])
+        self.assertEqual(1, len(inbox.mentions_of("@z@y.org")))
+        self.assertEqual(2, len(inbox))
+
+    def test_per_user_cap_newest_first(self):
+        inbox = MentionInbox(per_user=3)
+        for i in range(5):
+            inbox.record(post("#a", "@x@y.com"), message_id=i)
+        self.assertEqual([4, 3, 2], [m.message_id for m in inbox.mentions_of("@x@y.com")])
+        self.assertEqual([4], [m.message_id for m in inbox.mentions_of("@x@y.com", 1)])
+
+    def test_least_recently_mentioned_user_evicted(self):
+        inbox = MentionInbox(max_users=2)
+        inbox.record(post("#a", "@a@y.com"))
+        inbox.record(post("#a", "@b@y.com"))
+        inbox.record(post("#a", "@a@y.com"))
+        inbox.record(post("#a", "@c@y.com"))
+        self.assertEqual([], inbox.mentions_of("@b@y.com"))
+        self.assertEqual(2, len(inbox.mentions_of("@a@y.com")))
+        self.assertEqual(1, len(inbox.mentions_of("@c@y.com")))
+
+    def test_ttl(self):
+        clock = FakeClock()
+        inbox = MentionInbox(ttl=60, clock=clock)
+        inbox.record(post("#a", "@x@y.com"), message_id=1)
+        clock.now = 30
+        inbox.record(post("#a", "@x@y.com"), message_id=2)
+        clock.now = 70
+        self.assertEqual([2], [m.message_id for m in inbox.mentions_of("@x@y.com")])
+        clock.now = 100
+        self.assertEqual([], inbox.mentions_of("@x@y.com"))
+        self.assertEqual(0, len(inbox))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,48 @@
+import unittest
+
+from message_store import MessageStore
+
+
+class TestMessageStore(unittest.TestCase):
+    def test_channel_ring(self):
+        store = MessageStore(channel_capacity=3)
+        ids = [store.post_channel("#a", f"m{i}", set()) for i in range(5)]
+        store.post_channel("#b", "other", set())
+        self.assertEqual(["m2", "m3", "m4"], [m.message for m in store.read_channel("#a")])
+        self.assertEqual(["m3", "m4"], [m.message for m in store.read_channel("#a", 2)])
+        self.assertEqual(ids[2:], [m.id for m in store.read_channel("#a")])
+        self.assertEqual([], store.read_channel("#nowhere"))
+        self.assertNotIn(ids[0], store.messages)
+
+    def test_dm_mailboxes(self):
+        store = MessageStore()
+        store.post_dm("@a@b.com", "hi", set())
+        store.post_dm("@c@d.org", "yo", set())
+        self.assertEqual(["hi"], [m.message for m in store.read_dm("@a@b.com")])
+        self.assertEqual({"@a@b.com", "@c@d.org"}, store.users)
+
+    def test_mention_index(self):
+        store = MessageStore(channel_capacity=2)
+        store.post_channel("#a", "old @x@y.com", {"@x@y.com"})
+        store.post_dm("@z@y.com", "dm @x@y.com", {"@x@y.com"})
+        store.post_channel("#a", "filler", set())
+        store.post_channel("#a", "new @x@y.com", {"@x@y.com"})
+        # the first message has fallen out of #a, so it is no longer returned
+        self.assertEqual(["dm @x@y.com", "new @x@y.com"], [m.message for m in store.mentions_of("@x@y.com")])
+        self.assertEqual(["new @x@y.com"], [m.message for m in store.mentions_of("@x@y.com", 1)])
+        self.assertEqual([], store.mentions_of("@nobody@y.com"))
+
+    def test_mention_index_pruned(self):
+        store = MessageStore(channel_capacity=2, mailbox_capacity=100, mention_capacity=3)
+        store.post_dm("@z@y.com", "dm @x@y.com", {"@x@y.com"})
+        for i in range(50):
+            store.post_channel("#a", f"m{i} @x@y.com @h{i}@y.com", {"@x@y.com", f"@h{i}@y.com"})
+        # evicted ids leave the index even when they aren't the oldest in it
+        self.assertEqual(["dm @x@y.com", "m48 @x@y.com @h48@y.com", "m49 @x@y.com @h49@y.com"],
+                         [m.message for m in store.mentions_of("@x@y.com")])
+        self.assertEqual(3, len(store.mentioned["@x@y.com"]))
+        self.assertEqual({"@x@y.com", "@h48@y.com", "@h49@y.com"}, set(store.mentioned))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,341 @@
+import math
+import unittest
+
+import numpy as np
+
+import probability as PR
+
+tolerance = 1e-12
+
+coin = { 'heads': 0.25, 'tails': 0.25, 'edge': 0.5 }
+
+betA = { 'A': 1.1, 'B': -1 }
+betB = { 'A': -1, 'B': 0.5 }
+noBet = { 'A': 0, 'B': 0 }
+bets = { 'betA': betA, 'betB': betB, 'noBet': noBet }
+
+
+class TestIsProbDist(unittest.TestCase):
+   def test_dicts(self):
+      self.assertTrue(PR.isProbDist(coin))
+      P = dict.fromkeys('abcdefghij', 0.1)
+      self.assertNotEqual(1, sum(P.values()))                      # 0.9999999999999999
+      self.assertTrue(PR.isProbDist(P, tolerance=0))                # but fsum gets it exactly
+      self.assertTrue(PR.isProbDist({ 'a': 0.5, 'b': 0.5 + 1e-12 }))
+      self.assertFalse(PR.isProbDist({ 'a': 0.5, 'b': 0.5 + 1e-12 }, tolerance=1e-15))
+      self.assertFalse(PR.isProbDist({ 'a': 0.5, 'b': 0.4 }))
+      self.assertFalse(PR.isProbDist({ 'a': 1.5, 'b': -0.5 }))
+      self.assertFalse(PR.isProbDist({ 'a': float('nan'), 'b': 1 }))
+      self.assertFalse(PR.isProbDist({}))
+
+   def test_arrays(self):
+      rng = np.random.default_rng(4)
+      probs = rng.random(100_000)
+      probs /= probs.sum()
+      self.assertTrue(PR.isProbDist(probs))
+      self.assertTrue(PR.isProbDist(PR.Distribution(range(len(probs)), probs)))
+      self.assertTrue(PR.isProbDist(np.full(10, 0.1)))
+      self.assertFalse(PR.isProbDist(probs * 1.01))
+      probs[0] = -probs[0]
+      self.assertFalse(PR.isProbDist(probs))
+      self.assertFalse(PR.isProbDist(np.array([])))
+
+
+class TestDistribution(unittest.TestCase):
+   def test_round_trip(self):
+      D = PR.Distribution.fromDict(coin)
+      self.assertEqual(coin, D.toDict())
+      self.assertEqual(np.float64, D.probs.dtype)
+      self.assertEqual(3, len(D))
+
+   def test_events(self):
+      D = PR.Distribution.fromDict(coin)
+      notTails = { 'heads', 'edge' }
+      mask = np.array([ True, False, True ])
+      self.assertAlmostEqual(PR.probEvent(coin, notTails), PR.probEvent(D, notTails), delta=tolerance)
+      self.assertAlmostEqual(0.75, PR.probEvent(D, mask), delta=tolerance)
+      self.assertAlmostEqual(0.75, PR.probEvent(D, np.array([ 0, 2 ])), delta=tolerance)
+      self.assertAlmostEqual(0.5, PR.probEvent(D, { 'edge', 'not an outcome' }), delta=tolerance)
+      self.assertAlmostEqual(PR.prob(coin, { 'tails', 'edge' }, { 'heads', 'tails' }),
+                             PR.prob(D, { 'tails', 'edge' }, mask ^ True), delta=tolerance)
+
+   def test_conditional(self):
+      D = PR.Distribution.fromDict(coin)
+      C = { 'heads', 'tails' }
+      expected = PR.conditionalProbDistribution(coin, C)
+      self.assertEqual({ 'heads': 0.5, 'tails': 0.5, 'edge': 0 }, expected)
+      self.assertEqual(expected, PR.conditionalProbDistribution(D, C).toDict())
+      self.assertIsNone(PR.conditionalProbDistribution(D, set()))
+      self.assertAlmostEqual(PR.conditionalProb(coin, { 'heads' }, C), PR.conditionalProb(D, { 'heads' }, C), delta=tolerance)
+      self.assertIsNone(PR.conditionalProb(D, { 'heads' }, set()))
+
+   def test_utility_and_decide(self):
+      P = { 'A': 0.4, 'B': 0.6 }
+      D = PR.Distribution.fromDict(P)
+      self.assertAlmostEqual(PR.utility(P, betA), PR.utility(D, betA), delta=tolerance)
+      self.assertAlmostEqual(PR.utility(P, betB), PR.utility(D, np.array([ -1, 0.5 ])), delta=tolerance)
+      choice, utility = PR.decide(D, bets)
+      self.assertEqual(PR.decide(P, bets)[0], choice)
+      self.assertAlmostEqual(PR.decide(P, bets)[1], utility, delta=tolerance)
+
+
+class TestDecideBatch(unittest.TestCase):
+   def test_matches_decide(self):
+      rng = np.random.default_rng(3)
+      weights = rng.random((300, 2))
+      Ps = [ { 'A': a / (a + b), 'B': b / (a + b) } for a, b in weights ]
+      choices, utilities = PR.decideBatch(Ps, bets)
+      for P, choice, utility in zip(Ps, choices, utilities):
+         expectedChoice, expectedUtility = PR.decide(P, bets)
+         self.assertEqual(expectedChoice, choice)
+         self.assertAlmostEqual(expectedUtility, utility, delta=tolerance)
+
+   def test_matrix(self):
+      Ps = np.array([ [ 0.4, 0.6 ], [ 0.9, 0.1 ], [ 0.2, 0.8 ] ])
+      choices, utilities = PR.decideBatch(Ps, bets)
+      self.assertEqual([ 'noBet', 'betA', 'betB' ], choices)
+      np.testing.assert_allclose([ 0, 0.89, 0.2 ], utilities, atol=tolerance)
+      D = PR.Distribution([ 'B', 'A' ], [ 0.1, 0.9 ])       # outcomes in a different order
+      self.assertEqual([ 'betA', 'betA' ], PR.decideBatch([ D, { 'A': 0.9, 'B': 0.1 } ], bets)[0])
+
+
+class TestLogDistribution(unittest.TestCase):
+   def test_events(self):
+      L = PR.LogDistribution.fromDict({ 'heads': 0.25, 'tails': 0.75, 'edge': 0 })
+      self.assertEqual(2, len(L))                                   # edge isn't stored
+      self.assertAlmostEqual(0.25, PR.probEvent(L, { 'heads', 'edge' }), delta=tolerance)
+      self.assertAlmostEqual(0.75, PR.prob(L, { 'tails', 'edge' }, { 'tails', 'heads', 'unknown' }), delta=tolerance)
+      self.assertEqual(0, PR.probEvent(L, { 'edge' }))
+      self.assertAlmostEqual(1, PR.conditionalProb(L, { 'tails' }, { 'tails', 'edge' }), delta=tolerance)
+      self.assertIsNone(PR.conditionalProbDistribution(L, { 'edge' }))
+
+   def test_utility_and_decide(self):
+      P = { 'A': 0.4, 'B': 0.6 }
+      L = PR.LogDistribution.fromDict(P)
+      self.assertAlmostEqual(PR.utility(P, betA), PR.utility(L, betA), delta=tolerance)
+      self.assertEqual(PR.decide(P, bets)[0], PR.decide(L, bets)[0])
+
+   def test_posterior_matches(self):
+      L = { 'biased': { 'heads': 0.7, 'tails': 0.3 }, 'unbiased': PR.LogDistribution.fromDict({ 'heads': 0.5, 'tails': 0.5 }) }
+      prior = { 'biased': 0.1, 'unbiased': 0.9 }
+      expected, marginal = PR.posterior(prior, L, { 'heads' }, returnMarginal=True)
+      result, logMarginal = PR.posterior(PR.LogDistribution.fromDict(prior), L, { 'heads' }, returnMarginal=True)
+      self.assertIsInstance(result, PR.LogDistribution)
+      self.assertAlmostEqual(math.log(marginal), logMarginal, delta=tolerance)
+      self.assertAlmostEqual(math.log(marginal), PR.logMarginalLikelihood(prior, L, { 'heads' }), delta=tolerance)
+      for H in prior:
+         self.assertAlmostEqual(expected[H], result.toDict()[H], delta=tolerance)
+
+   def test_no_underflow(self):
+      # every likelihood is tiny, so P(E | H) P(H) underflows to 0 in linear space
+      likelihood = { H: PR.LogDistribution({ 'x': -800.0 - H, 'y': math.log1p(-math.exp(-800.0 - H)) }) for H in range(3) }
+      prior = PR.LogDistribution.fromDict({ 0: 0.2, 1: 0.3, 2: 0.5 })
+      result, logMarginal = PR.posterior(prior, likelihood, { 'x' }, returnMarginal=True)
+      self.assertEqual(0, PR.marginalLikelihood({ 0: 0.2, 1: 0.3, 2: 0.5 }, likelihood, { 'x' }))
+      self.assertTrue(math.isfinite(logMarginal))
+      posterior = result.toDict()
+      self.assertAlmostEqual(1, sum(posterior.values()), delta=1e-9)
+      self.assertGreater(posterior[0], posterior[1])
+
+
+class TestProbBatch(unittest.TestCase):
+   def test_matches_prob(self):
+      rng = np.random.default_rng(2)
+      outcomes = range(100)
+      weights = rng.random(len(outcomes))
+      P = dict(zip(outcomes, weights / weights.sum()))
+      events = [ set(rng.choice(outcomes, size=40).tolist()) for _ in range(10) ]
+      queries = [ tuple(events[i] for i in rng.choice(10, size=rng.integers(0, 4))) for _ in range(500) ]
+      expected = [ PR.prob(P, *query) for query in queries ]
+      np.testing.assert_allclose(expected, PR.probBatch(P, queries), atol=tolerance)
+      D = PR.Distribution.fromDict(P)
+      np.testing.assert_allclose(expected, D.probBatch(queries), atol=tolerance)
+      self.assertEqual(10, len(D.masks))
+
+   def test_masks_and_indices(self):
+      D = PR.Distribution.fromDict(coin)
+      result = PR.probBatch(D, [ (np.array([ True, True, False ]), { 'tails', 'edge' }), (np.array([ 2 ]),), () ])
+      np.testing.assert_allclose([ 0.25, 0.5, 1 ], result, atol=tolerance)
+      self.assertEqual(0, len(PR.probBatch(D, [])))
+
+   def test_fresh_events(self):
+      # a generator building new sets for every query, so event objects are freed (and their ids reused) as it goes
+      rng = np.random.default_rng(3)
+      D = PR.Distribution(range(50), np.full(50, 1 / 50))
+      draws = [ (rng.integers(50, size=10).tolist(), rng.integers(50, size=10).tolist()) for _ in range(2000) ]
+      expected = [ D.prob(set(A), set(B)) for A, B in draws ]
+      result = D.probBatch((set(A), set(B)) for A, B in draws)
+      np.testing.assert_allclose(expected, result, atol=tolerance)
+
+   def test_mask_cache_bounded(self):
+      D = PR.Distribution(range(10), np.full(10, 0.1))
+      for i in range(D.maskCacheSize + 50):
+         D.eventMask({ i % 10, i })
+      self.assertEqual(D.maskCacheSize, len(D.masks))
+
+
+class TestConditionalCache(unittest.TestCase):
+   def test_hits(self):
+      cache = PR.ConditionalCache()
+      C = { 'heads', 'tails' }
+      first = cache.conditionalProbDistribution(coin, C)
+      self.assertEqual(PR.conditionalProbDistribution(coin, C), first)
+      self.assertIs(first, cache.conditionalProbDistribution(coin, frozenset(C)))
+      self.assertAlmostEqual(PR.conditionalProb(coin, { 'heads' }, C), cache.conditionalProb(coin, { 'heads' }, C), delta=tolerance)
+      self.assertIsNone(cache.conditionalProb(coin, { 'heads' }, set()))
+      self.assertEqual((2, 2), (cache.hits, cache.misses))
+
+   def test_lru(self):
+      cache = PR.ConditionalCache(maxSize=2)
+      cache.conditionalProbDistribution(coin, { 'heads' })
+      cache.conditionalProbDistribution(coin, { 'tails' })
+      cache.conditionalProbDistribution(coin, { 'heads' })
+      cache.conditionalProbDistribution(coin, { 'edge' })       # pushes out tails, the least recently used
+      self.assertEqual(2, len(cache))
+      cache.conditionalProbDistribution(coin, { 'heads' })
+      self.assertEqual(2, cache.hits)
+      cache.conditionalProbDistribution(coin, { 'tails' })
+      self.assertEqual(4, cache.misses)
+
+   def test_invalidation(self):
+      cache = PR.ConditionalCache()
+      P = dict(coin)
+      D = PR.Distribution.fromDict(coin)
+      C = { 'heads', 'edge' }
+      cache.conditionalProbDistribution(P, C)
+      P['heads'], P['edge'] = 0.5, 0.25
+      cache.invalidate(P)
+      self.assertAlmostEqual(2 / 3, cache.conditionalProbDistribution(P, C)['heads'], delta=tolerance)
+
+      self.assertAlmostEqual(1 / 3, cache.conditionalProb(D, { 'heads' }, C), delta=tolerance)
+      D.setProbs([ 0.5, 0.25, 0.25 ])
+      self.assertAlmostEqual(2 / 3, cache.conditionalProb(D, { 'heads' }, C), delta=tolerance)
+      D.probs[:] = [ 0.25, 0.5, 0.25 ]
+      D.changed()
+      self.assertAlmostEqual(0.5, cache.conditionalProb(D, { 'heads' }, C), delta=tolerance)
+
+      cache.invalidate()
+      self.assertEqual(0, len(cache))
+
+   def test_mask_events(self):
+      # masks all turn into frozenset({False, True}), so they need keys of their own
+      cache = PR.ConditionalCache()
+      P = PR.Distribution(range(6), np.full(6, 1 / 6))
+      first = np.array([ 1, 0, 0, 0, 0, 0 ], dtype=bool)
+      self.assertAlmostEqual(1.0, cache.conditionalProb(P, { 0 }, first), delta=tolerance)
+      self.assertAlmostEqual(0.0, cache.conditionalProb(P, { 0 }, ~first), delta=tolerance)
+      self.assertAlmostEqual(0.5, cache.conditionalProb(P, { 0 }, { 0, 1 }), delta=tolerance)
+      self.assertAlmostEqual(1.0, cache.conditionalProb(P, { 0 }, np.array([ 0 ])), delta=tolerance)
+      self.assertEqual((0, 4), (cache.hits, cache.misses))
+
+
+class TestAliasSampler(unittest.TestCase):
+   field = { 'drought': 4, 'hail': 1, 'grasshoppers': 1, 'no failure': 14 }
+
+   def test_frequencies(self):
+      sampler = PR.AliasSampler(self.field, rng=5)
+      draws = sampler.draws(200_000)
+      for outcome, weight in self.field.items():
+         self.assertAlmostEqual(weight / 20, np.mean(draws == outcome), delta=0.005)
+      single = [ sampler.draw() for _ in range(20_000) ]
+      self.assertAlmostEqual(0.7, single.count('no failure') / len(single), delta=0.02)
+
+   def test_reproducible(self):
+      D = PR.Distribution.fromDict(coin)
+      self.assertEqual(list(D.sampler(7).draws(100)), list(D.sampler(7).draws(100)))
+      a, b = D.sampler(np.random.default_rng(8)), D.sampler(np.random.default_rng(8))
+      self.assertEqual([ a.draw() for _ in range(50) ], [ b.draw() for _ in range(50) ])
+
+   def test_zero_weights(self):
+      sampler = PR.AliasSampler({ 'never': 0, 'a': 1, 'b': 0, 'c': 3 }, rng=0)
+      draws = set(sampler.draws(10_000)) | { sampler.draw() for _ in range(1000) }
+      self.assertEqual({ 'a', 'c' }, draws)
+      self.assertEqual({ 'only' }, set(PR.AliasSampler(PR.LogDistribution({ 'only': 0.0 })).draws(10)))
+      with self.assertRaises(ValueError):
+         PR.AliasSampler({ 'a': 0 })
+      with self.assertRaises(ValueError):
+         PR.AliasSampler({})
+
+
+def naivePosterior(prior, likelihood, E):
+   '''The original posterior, which recomputes the marginal likelihood for every hypothesis'''
+   return { H: PR.prob(likelihood[H], E) * pH / PR.marginalLikelihood(prior, likelihood, E) for H, pH in prior.items() }
+
+
+class TestPosterior(unittest.TestCase):
+   def test_coin(self):
+      L = { 'biased': { 'heads': 0.7, 'tails': 0.3 }, 'unbiased': { 'heads': 0.5, 'tails': 0.5 } }
+      prior = { 'biased': 0.1, 'unbiased': 0.9 }
+      result, marginal = PR.posterior(prior, L, { 'heads' }, returnMarginal=True)
+      self.assertAlmostEqual(0.52, marginal, delta=tolerance)
+      self.assertAlmostEqual(0.07 / 0.52, result['biased'], delta=tolerance)
+      self.assertEqual(result, PR.posterior(prior, L, { 'heads' }))
+
+   def test_matches_naive(self):
+      rng = np.random.default_rng(0)
+      outcomes = range(20)
+      hypotheses = range(200)
+      priorWeights = rng.random(len(hypotheses))
+      prior = dict(zip(hypotheses, priorWeights / priorWeights.sum()))
+      likelihood = {}
+      for H in hypotheses:
+         weights = rng.random(len(outcomes))
+         likelihood[H] = dict(zip(outcomes, weights / weights.sum()))
+      E = { 1, 5, 7, 19 }
+      expected = naivePosterior(prior, likelihood, E)
+      result = PR.posterior(prior, likelihood, E)
+      self.assertEqual(expected.keys(), result.keys())
+      for H in hypotheses:
+         self.assertAlmostEqual(expected[H], result[H], delta=tolerance)
+
+
+class TestBayesianUpdater(unittest.TestCase):
+   likelihood = {
+      'dry':    { 'drought': 0.4, 'hail': 0.1, 'no failure': 0.5 },
+      'stormy': { 'drought': 0.1, 'hail': 0.4, 'no failure': 0.5 },
+      'good':   { 'drought': 0.05, 'hail': 0.05, 'no failure': 0.9 },
+   }
+   prior = { 'dry': 0.3, 'stormy': 0.3, 'good': 0.4 }
+
+   def test_mask_events(self):
+      outcomes = [ 'drought', 'hail', 'no failure' ]
+      likelihood = { H: PR.Distribution(outcomes, [ L[x] for x in outcomes ]) for H, L in self.likelihood.items() }
+      updater = PR.BayesianUpdater(self.prior, likelihood)
+      drought, hail = np.array([ True, False, False ]), np.array([ False, True, False ])
+      expected = PR.BayesianUpdater(self.prior, self.likelihood)
+      for E, F in ((drought, { 'drought' }), (hail, { 'hail' }), (drought, { 'drought' })):
+         self.assertAlmostEqual(expected.update(F), updater.update(E), delta=tolerance)
+      for H in self.prior:
+         self.assertAlmostEqual(expected.posterior[H], updater.posterior[H], delta=tolerance)
+      self.assertEqual(2, len(updater.logLikelihoods))
+
+   def test_matches_repeated_posterior(self):
+      events = [ { 'drought' }, { 'no failure' }, { 'hail', 'drought' }, { 'no failure' } ]
+      updater = PR.BayesianUpdater(self.prior, self.likelihood)
+      expected = self.prior
+      marginal = 1
+      for E in events:
+         expected, evidence = PR.posterior(expected, self.likelihood, E, returnMarginal=True)
+         marginal *= evidence
+         self.assertAlmostEqual(evidence, updater.update(E), delta=tolerance)
+      for H in self.prior:
+         self.assertAlmostEqual(expected[H], updater.posterior[H], delta=tolerance)
+      self.assertAlmostEqual(marginal, updater.marginalLikelihood, delta=tolerance)
+
+   def test_long_horizon(self):
+      rng = np.random.default_rng(1)
+      outcomes = rng.choice([ 'drought', 'hail', 'no failure' ], p=[ 0.4, 0.1, 0.5 ], size=5000)
+      updater = PR.BayesianUpdater(self.prior, self.likelihood).updateAll({ outcome } for outcome in outcomes)
+      self.assertGreater(updater.posterior['dry'], 0.99)
+      self.assertAlmostEqual(1, sum(updater.posterior.values()), delta=1e-9)
+      self.assertEqual(0, updater.marginalLikelihood)         # underflows ...
+      self.assertTrue(np.isfinite(updater.logMarginalLikelihood))   # ... but the log doesn't
+
+   def test_impossible_event(self):
+      updater = PR.BayesianUpdater({ 'dry': 1, 'stormy': 0, 'good': 0 }, self.likelihood)
+      self.assertIsNone(updater.update({ 'locusts' }))
+      self.assertEqual({ 'dry': 1, 'stormy': 0, 'good': 0 }, updater.posterior)
+
+
+if __name__ == '__main__':
+   unittest.main()
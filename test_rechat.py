@@ -0,0 +1,157 @@
+# Tests for the parts of specialtopics.py beyond reChatParseCommand (ChatSession, ChatState and the
+# validators).  They're kept out of test_STA_fsa.py so they don't use up its seeded random stream.
+
+import random
+import unittest
+from string import ascii_lowercase
+
+import specialtopics as ST
+
+rng = random.Random(0)
+
+
+def randomPart():
+    return "".join(rng.choice(ascii_lowercase) for _ in range(rng.randint(1, 5)))
+
+
+def randomUsername():
+    mailbox = ".".join(randomPart() for _ in range(rng.randint(1, 3)))
+    domain = ".".join(randomPart() for _ in range(rng.randint(1, 3))) + rng.choice([".com", ".org"])
+    return "@" + mailbox + "@" + domain
+
+
+def randomChannel():
+    return "#" + rng.choice(ascii_lowercase.upper()) + "".join(rng.choice(ascii_lowercase + "0123456789") for _ in range(rng.randint(1, 8)))
+
+
+def runReChatParser(correctTranscript):
+    state = None
+    transcript = []
+    for message, _ in correctTranscript:
+        r, state = ST.reChatParseCommand(message, state)
+        transcript.append((message, r))
+    return transcript
+
+
+def runReChatSession(correctTranscript):
+    messages = [message for message, _ in correctTranscript]
+    return list(zip(messages, ST.reChatParseMessages(messages)))
+
+
+class TestSession(unittest.TestCase):
+    def test_session_matches_single_messages(self):
+        channel = randomChannel()
+        user = randomUsername()
+        user2 = randomUsername()
+        correctTranscript = [
+            ("", {"action": "greeting"}),
+            ("\\join " + channel, {"action": "join", "channel": channel}),
+            ("\\dm " + user, {"error": "Invalid command"}),
+            (
+                "Hello " + user2,
+                {
+                    "action": "postChannel",
+                    "channel": channel,
+                    "message": "Hello " + user2,
+                    "mentions": {user2},
+                },
+            ),
+            ("\\leave", {"action": "leaveChannel", "channel": channel}),
+            ("\\dm " + user, {"action": "dm", "user": user}),
+            ("\\read", {"action": "readDM", "user": user}),
+            ("\\leave", {"action": "leaveDM", "user": user}),
+            ("\\quit", {"action": "quit"}),
+        ]
+        self.assertEqual(correctTranscript, runReChatSession(correctTranscript))
+        self.assertEqual(runReChatParser(correctTranscript), runReChatSession(correctTranscript))
+
+    def test_session_keeps_state(self):
+        channel = randomChannel()
+        session = ST.ChatSession()
+        self.assertEqual({"action": "greeting"}, session.parse(""))
+        session.parse("\\join " + channel)
+        self.assertEqual("channel", session.state.mode)
+        self.assertEqual(channel, session.state.current_channel)
+        self.assertEqual(
+            [{"action": "readChannel", "channel": channel}],
+            list(ST.reChatParseMessages(["\\read"], session.state)),
+        )
+
+    def test_dict_state(self):
+        # the state reChatParseCommand returns can carry on into a batch
+        channel = randomChannel()
+        _, state = ST.reChatParseCommand("", None)
+        _, state = ST.reChatParseCommand("\\join " + channel, state)
+        self.assertEqual(
+            [{"action": "readChannel", "channel": channel}, {"action": "leaveChannel", "channel": channel}],
+            list(ST.reChatParseMessages(["\\read", "\\leave"], state)),
+        )
+
+
+class TestChatState(unittest.TestCase):
+    def test_states_are_shared(self):
+        channel = randomChannel()
+        user = randomUsername()
+        _, state = ST.reChatParseCommand("", None)
+        self.assertIs(ST.COMMAND_STATE, ST.ChatState.from_dict(state))
+        _, state = ST.reChatParseCommand("\\join " + channel, state)
+        self.assertIs(ST.channel_state(channel), ST.ChatState.from_dict(state))
+        self.assertIs(ST.dm_state(user), ST.ChatState.from_dict({"mode": "dm", "current_user": user}))
+
+    def test_long_names_not_shared(self):
+        ST.shared_channel_state.cache_clear()
+        ST.shared_dm_state.cache_clear()
+        channel, user = "#a" + "b" * 100000, "@" + "a" * 100000 + "@b.com"
+        state = ST.reChatParseCommand("\\join " + channel, {"mode": "command"})[1]
+        self.assertEqual(ST.ChatState(ST.CHANNEL_MODE, current_channel=channel), ST.ChatState.from_dict(state))
+        self.assertEqual(ST.dm_state(user), ST.ChatState(ST.DM_MODE, current_user=user))
+        self.assertEqual(0, ST.shared_channel_state.cache_info().currsize)
+        self.assertEqual(0, ST.shared_dm_state.cache_info().currsize)
+
+    def test_state_is_immutable(self):
+        with self.assertRaises(AttributeError):
+            ST.COMMAND_STATE.current_channel = randomChannel()
+        self.assertFalse(hasattr(ST.COMMAND_STATE, "__dict__"))
+
+    def test_dict_round_trip(self):
+        state = ST.channel_state(randomChannel())
+        self.assertEqual(state, ST.ChatState.from_dict(state.to_dict()))
+        self.assertEqual("channel", state.mode)
+
+
+class TestValidators(unittest.TestCase):
+    def test_username_is_anchored(self):
+        user = randomUsername()
+        self.assertTrue(ST.is_valid_username(user))
+        self.assertFalse(ST.is_valid_username(user + ".garbage"))
+        self.assertFalse(ST.is_valid_username("@a@b.com.garbage"))
+        self.assertFalse(ST.is_valid_username(user[1:]))
+
+    def test_long_usernames_not_cached(self):
+        ST.cached_username_matches.cache_clear()
+        user = "@" + "a" * 1000 + "@b.com"
+        self.assertTrue(ST.is_valid_username(user))
+        self.assertFalse(ST.is_valid_username(user + "x" * 100000))
+        self.assertEqual(0, ST.cached_username_matches.cache_info().currsize)
+        self.assertTrue(ST.is_valid_username("@a@b.com"))
+        self.assertEqual(1, ST.cached_username_matches.cache_info().currsize)
+
+    def test_dm_rejects_trailing_garbage(self):
+        correctTranscript = [
+            ("", {"action": "greeting"}),
+            ("\\dm @a@b.com.garbage", {"error": "Invalid command"}),
+            ("\\dm @a@b.com", {"action": "dm", "user": "@a@b.com"}),
+        ]
+        transcript = runReChatParser(correctTranscript)
+        self.assertEqual(correctTranscript, transcript)
+
+    def test_mentions_are_whole_words(self):
+        user = randomUsername()
+        user2 = randomUsername()
+        message = f"{user}\thi {user2}\n{user2}, x{user} {user}.garbage @a@b.com"
+        self.assertEqual({user, user2, "@a@b.com"}, ST.extract_mentions(message))
+        self.assertEqual(set(), ST.extract_mentions(""))
+
+
+if __name__ == "__main__":
+    unittest.main()
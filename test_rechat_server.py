@@ -0,0 +1,81 @@
+import asyncio
+import json
+import unittest
+
+import rechat_server as RS
+
+
+class TestReChatServer(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.server = await RS.ReChatServer().start()
+        self.port = RS.server_port(self.server)
+
+    async def asyncTearDown(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def test_channel_round_trip(self):
+        poster = await RS.run_client("127.0.0.1", self.port, [
+            "\\join #general",
+            "Hello @bob@example.com",
+            "\\quit",
+        ])
+        self.assertEqual({"action": "greeting"}, poster[0])
+        self.assertEqual(["@bob@example.com"], poster[2]["mentions"])
+
+        reader = await RS.run_client("127.0.0.1", self.port, [
+            "\\list channels",
+            "\\list users",
+            "\\join #general",
+            "\\read",
+            "\\nothing",
+        ])
+        self.assertEqual(["#general"], reader[1]["items"])
+        self.assertEqual(["@bob@example.com"], reader[2]["items"])
+        self.assertEqual(["Hello @bob@example.com"], reader[4]["messages"])
+        self.assertEqual({"error": "Invalid command"}, reader[5])
+
+    async def test_dm(self):
+        await RS.run_client("127.0.0.1", self.port, ["\\dm @al@x.org", "hi", "there"])
+        replies = await RS.run_client("127.0.0.1", self.port, ["\\dm @al@x.org", "\\read"])
+        self.assertEqual(["hi", "there"], replies[2]["messages"])
+
+    async def test_quit_closes_connection(self):
+        reader, writer = await asyncio.open_connection("127.0.0.1", self.port)
+        await reader.readline()
+        writer.write(b"\\quit\n")
+        self.assertEqual({"action": "quit"}, json.loads(await reader.readline()))
+        self.assertEqual(b"", await reader.readline())
+        writer.close()
+        await writer.wait_closed()
+
+    async def test_line_too_long(self):
+        # a line over the limit gets an error reply and the lines after it are still read
+        server = await RS.ReChatServer(line_limit=1000).start()
+        try:
+            replies = await RS.run_client("127.0.0.1", RS.server_port(server), [
+                "\\join #general",
+                "x" * 5000,
+                "y" * 1500,
+                "hello",
+            ])
+        finally:
+            server.close()
+            await server.wait_closed()
+        self.assertEqual(RS.TOO_LONG, replies[2])
+        self.assertEqual(RS.TOO_LONG, replies[3])
+        self.assertEqual("postChannel", replies[4]["action"])
+        self.assertEqual("hello", replies[4]["message"])
+
+    async def test_64k_message(self):
+        message = "z" * 70000
+        replies = await RS.run_client("127.0.0.1", self.port, ["\\join #big", message, "\\read"])
+        self.assertEqual([message], replies[3]["messages"])
+
+    async def test_many_connections(self):
+        messages, _ = await RS.load_test(200)
+        self.assertEqual(200 * 10, messages)
+
+
+if __name__ == "__main__":
+    unittest.main()